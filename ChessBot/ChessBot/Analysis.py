@@ -0,0 +1,194 @@
+# Batch analysis over many positions using every core. Positions go to worker processes as FEN strings (never as pickled
+# GameState objects) and each worker rebuilds its own GameState, runs a search or a perft, and sends back a small
+# dictionary. Results come back in input order with the time each job took.
+#
+#   python -m ChessBot.Analysis positions.epd --job search --depth 4 --workers 8
+#   python -m ChessBot.Analysis positions.epd --job perft --depth 3
+#   python -m ChessBot.Analysis --fen "<fen>" --job split --depth 5    (one deep search, root moves split across cores)
+#
+# Position files hold one FEN or EPD record per line; blank lines and lines starting with '#' are skipped.
+
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .Book import OpeningBook, EndgameTable
+from .ChessEngine import GameState
+from .perft import perft
+from .Search import Search, MATE, MAX_PLY
+from .TranspositionTable import TranspositionTable
+
+_table = None #one transposition table per worker process, see workerTable
+
+
+'''
+Yields the FEN of every position in a FEN/EPD file without reading the whole file in. EPD records only have the first
+four FEN fields, so the move counters are filled in
+'''
+def readPositions(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(';')[0].split()
+            if len(fields) > 6 or (len(fields) == 6 and not fields[4].isdigit()):
+                fields = fields[:4] #EPD operations follow the fourth field
+            if len(fields) == 4:
+                fields += ['0', '1']
+            yield ' '.join(fields)
+
+
+######## WORKER JOBS (run in the worker processes, so they only take and return plain data)
+
+'''
+The transposition table of this process, made on first use and kept for every later job. A new table costs a 16 MB
+allocation and zeroing, which is a big part of a shallow search. Search.search ages the entries of earlier jobs
+through newSearch, so they are replaced first
+'''
+def workerTable():
+    global _table
+    if _table is None:
+        _table = TranspositionTable()
+    return _table
+
+
+'''
+A position that can't be read comes back as {'fen', 'error', 'time'} instead of raising, so one bad line doesn't end
+the rest of the batch
+'''
+def searchJob(fen, depth, timeLimit, nodeLimit, book=None, endgameTable=None):
+    start = time.perf_counter()
+    try:
+        gs = GameState.fromFen(fen)
+    except ValueError as e:
+        return {'fen': fen, 'error': str(e), 'time': time.perf_counter() - start}
+    search = Search(gs, workerTable(), book, endgameTable)
+    move = search.search(maxDepth=depth, timeLimit=timeLimit, nodeLimit=nodeLimit, report=None)
+    return {'fen': fen, 'bestMove': move.getChessNotation() if move is not None else None, 'score': search.score,
+            'depth': search.depth, 'nodes': search.nodes, 'time': time.perf_counter() - start}
+
+def perftJob(fen, depth):
+    start = time.perf_counter()
+    try:
+        gs = GameState.fromFen(fen)
+    except ValueError as e:
+        return {'fen': fen, 'error': str(e), 'time': time.perf_counter() - start}
+    return {'fen': fen, 'depth': depth, 'nodes': perft(gs, depth), 'time': time.perf_counter() - start}
+
+'''
+Searches the position after one root move. The score is from the root side's point of view
+'''
+def rootMoveJob(fen, code, depth):
+    start = time.perf_counter()
+    gs = GameState.fromFen(fen)
+    notation = gs.moveFromCode(code).getChessNotation()
+    gs.makeMoveCode(code)
+    search = Search(gs, workerTable())
+    if not gs.getValidMoveCodes():
+        score = MATE - 1 if gs.inCheck() else 0 #the move mates or stalemates
+    else:
+        search.search(maxDepth=max(depth, 1), report=None)
+        score = -search.score
+        if score >= MATE - MAX_PLY: #mates are one ply further away from the real root
+            score -= 1
+        elif score <= -MATE + MAX_PLY:
+            score += 1
+    return {'move': notation, 'score': score, 'nodes': search.nodes, 'time': time.perf_counter() - start}
+
+
+'''
+Runs job(*args) for every args tuple in jobs on a process pool and yields the results in input order. At most
+window jobs are in flight, so a long stream of positions is never read into memory all at once
+'''
+def runJobs(job, jobs, workers=None, window=None):
+    workers = workers or os.cpu_count() or 1
+    window = window or workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for args in jobs:
+            pending.append(executor.submit(job, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+'''
+book and endgameTable are sent to the workers as their paths, and each worker maps the files itself
+'''
+def analyzePositions(fens, depth=4, timeLimit=None, nodeLimit=None, workers=None, book=None, endgameTable=None):
+    return runJobs(searchJob, ((fen, depth, timeLimit, nodeLimit, book, endgameTable) for fen in fens), workers)
+
+def perftPositions(fens, depth=3, workers=None):
+    return runJobs(perftJob, ((fen, depth) for fen in fens), workers)
+
+'''
+One deep search split by root move: every root move is searched to depth - 1 in its own job and the best one is
+returned as (move, score, per-move results). The workers don't share bounds, so this trades some extra nodes for cores
+'''
+def splitSearch(fen, depth, workers=None):
+    gs = GameState.fromFen(fen)
+    results = list(runJobs(rootMoveJob, ((fen, code, depth - 1) for code in gs.getValidMoveCodes()), workers))
+    if not results:
+        return None, 0, results
+    best = max(results, key=lambda result: result['score'])
+    return best['move'], best['score'], results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ChessBot.Analysis', description='Search or perft many positions')
+    parser.add_argument('files', nargs='*', help='FEN/EPD files, one position per line')
+    parser.add_argument('--fen', action='append', default=[], help='a position to analyse, can be repeated')
+    parser.add_argument('--job', choices=['search', 'perft', 'split'], default='search')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--time', type=float, default=None, help='seconds per search')
+    parser.add_argument('--nodes', type=int, default=None, help='nodes per search')
+    parser.add_argument('--book', default=None, help='Polyglot opening book for --job search')
+    parser.add_argument('--endgame-table', default=None, help='endgame table file for --job search')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+
+    def positions():
+        yield from args.fen
+        for path in args.files:
+            yield from readPositions(path)
+
+    start = time.perf_counter()
+    failed = 0
+    if args.job == 'split':
+        for fen in positions():
+            try:
+                move, score, results = splitSearch(fen, args.depth, args.workers)
+            except ValueError as e:
+                failed += 1
+                print(f'error {e}')
+                continue
+            for result in sorted(results, key=lambda result: -result['score']):
+                print(f"{result['move']} score {result['score']} nodes {result['nodes']} time {result['time']:.2f}")
+            print(f'bestmove {move} score {score}  {fen}')
+    elif args.job == 'perft':
+        for result in perftPositions(positions(), args.depth, args.workers):
+            if 'error' in result:
+                failed += 1
+                print(f"error {result['error']}")
+                continue
+            print(f"{result['nodes']} nodes depth {result['depth']} time {result['time']:.2f}  {result['fen']}")
+    else:
+        book = OpeningBook(args.book) if args.book else None
+        endgameTable = EndgameTable(args.endgame_table) if args.endgame_table else None
+        for result in analyzePositions(positions(), args.depth, args.time, args.nodes, args.workers, book, endgameTable):
+            if 'error' in result:
+                failed += 1
+                print(f"error {result['error']}")
+                continue
+            print(f"{result['bestMove']} score {result['score']} depth {result['depth']} nodes {result['nodes']} "
+                  f"time {result['time']:.2f}  {result['fen']}")
+    print(f'Total time: {time.perf_counter() - start:.2f}s' + (f', {failed} positions could not be read' if failed else ''))
+    return 0 if not failed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# Precomputed attack tables. Everything here is built once when the module is imported and never changes.
+# The list tables are indexed [row][col] and hold the squares as (row, col) tuples for GameState's 8x8 board.
+# The mask tables are indexed by square = row * 8 + col and hold 64-bit masks for BitboardState.
+
+KNIGHT_STEPS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_STEPS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (-1, 1), (1, -1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+def _steps(steps):
+    return [[tuple((r + dr, c + dc) for dr, dc in steps if 0 <= r + dr < 8 and 0 <= c + dc < 8)
+             for c in range(8)] for r in range(8)]
+
+def _rays(directions):
+    table = []
+    for r in range(8):
+        row = []
+        for c in range(8):
+            rays = []
+            for dr, dc in directions:
+                ray = []
+                nr, nc = r + dr, c + dc
+                while 0 <= nr < 8 and 0 <= nc < 8:
+                    ray.append((nr, nc))
+                    nr, nc = nr + dr, nc + dc
+                rays.append(tuple(ray))
+            row.append(tuple(rays))
+        table.append(row)
+    return table
+
+def _mask(squares):
+    mask = 0
+    for r, c in squares:
+        mask |= 1 << (r * 8 + c)
+    return mask
+
+
+######## LIST TABLES (for GameState.board)
+KNIGHT_TARGETS = _steps(KNIGHT_STEPS)
+KING_TARGETS = _steps(KING_STEPS)
+# squares a pawn of each colour attacks from [row][col]; white pawns move towards row 0
+PAWN_TARGETS = {'w': _steps([(-1, -1), (-1, 1)]), 'b': _steps([(1, -1), (1, 1)])}
+# every ray leaving [row][col], nearest square first
+ROOK_RAYS = _rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _rays(BISHOP_DIRECTIONS)
+
+
+######## MASK TABLES (for BitboardState)
+KNIGHT_ATTACKS = [_mask(KNIGHT_TARGETS[sq // 8][sq % 8]) for sq in range(64)]
+KING_ATTACKS = [_mask(KING_TARGETS[sq // 8][sq % 8]) for sq in range(64)]
+PAWN_ATTACKS = [[_mask(PAWN_TARGETS[color][sq // 8][sq % 8]) for sq in range(64)] for color in 'wb']
+# rays are stored as (ray masks, True if the ray runs towards higher square numbers)
+ROOK_RAY_MASKS = [([_mask(ROOK_RAYS[sq // 8][sq % 8][i]) for sq in range(64)], dr * 8 + dc > 0)
+                  for i, (dr, dc) in enumerate(ROOK_DIRECTIONS)]
+BISHOP_RAY_MASKS = [([_mask(BISHOP_RAYS[sq // 8][sq % 8][i]) for sq in range(64)], dr * 8 + dc > 0)
+                    for i, (dr, dc) in enumerate(BISHOP_DIRECTIONS)]
+
+
+'''
+Attacks of a sliding piece on sq: each ray is cut off at the first blocker, which is included so captures come for free
+'''
+def slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for ray, positive in rays:
+        mask = ray[sq]
+        blockers = mask & occupied
+        if blockers:
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            mask ^= ray[blocker]
+        attacks |= mask
+    return attacks
+
+
+'''
+True if a piece of colour 'w' or 'b' attacks board[r][c]. Looks outward from the square with each piece's attack pattern,
+so no moves are generated
+'''
+def isSquareAttacked(board, r, c, color):
+    knight, king, pawn = color + 'N', color + 'K', color + 'p'
+    rookLike, bishopLike = (color + 'R', color + 'Q'), (color + 'B', color + 'Q')
+    for nr, nc in KNIGHT_TARGETS[r][c]:
+        if board[nr][nc] == knight:
+            return True
+    for nr, nc in KING_TARGETS[r][c]:
+        if board[nr][nc] == king:
+            return True
+    # an enemy pawn attacks (r, c) from the squares a pawn of our colour on (r, c) would attack
+    for nr, nc in PAWN_TARGETS['b' if color == 'w' else 'w'][r][c]:
+        if board[nr][nc] == pawn:
+            return True
+    for ray in ROOK_RAYS[r][c]:
+        for nr, nc in ray:
+            piece = board[nr][nc]
+            if piece != '--':
+                if piece in rookLike:
+                    return True
+                break
+    for ray in BISHOP_RAYS[r][c]:
+        for nr, nc in ray:
+            piece = board[nr][nc]
+            if piece != '--':
+                if piece in bishopLike:
+                    return True
+                break
+    return False
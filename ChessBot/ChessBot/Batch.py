@@ -0,0 +1,213 @@
+# Features for many positions at once, for data generation. Boards are an (N, 8, 8) int8 array with the same layout as
+# GameState.board (row 0 = rank 8) and a small integer per piece, see PIECE_CODES. Everything is computed with NumPy
+# operations over the whole batch, never one position at a time, and comes back as plain arrays ready for np.savez.
+#
+#   boards = encodeFens(fens)
+#   features = analyzeBatch(boards)
+#   np.savez('features.npz', boards=boards, **features)
+#
+#   python -m ChessBot.Batch positions.epd --out features.npz
+#
+# Colour index 0 is white and 1 is black, as in Bitboard. Mobility counts pseudo-legal moves (pins, checks, castling and
+# en passant aren't considered); use GameState.getValidMoveCodes when the exact legal moves are needed.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+from .Analysis import readPositions
+from .Attacks import KNIGHT_STEPS, KING_STEPS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS
+from .Evaluation import MG_SCORES, EG_SCORES, PHASE, MG_VALUES, MAX_PHASE
+
+PIECE_CODES = {'--': 0, 'wp': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
+               'bp': -1, 'bN': -2, 'bB': -3, 'bR': -4, 'bQ': -5, 'bK': -6}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+FEN_CODES = {'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6, 'p': -1, 'n': -2, 'b': -3, 'r': -4, 'q': -5, 'k': -6}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE = 0
+BLACK = 1
+
+# lookup tables indexed by piece code + 6 (and square for the piece-square scores)
+MG_TABLE = np.zeros((13, 64), np.int32)
+EG_TABLE = np.zeros((13, 64), np.int32)
+PHASE_TABLE = np.zeros(13, np.int32)
+VALUE_TABLE = np.zeros(13, np.int32)
+for _piece, _code in PIECE_CODES.items():
+    if _code:
+        MG_TABLE[_code + 6] = np.array(MG_SCORES[_piece]).ravel()
+        EG_TABLE[_code + 6] = np.array(EG_SCORES[_piece]).ravel()
+        PHASE_TABLE[_code + 6] = PHASE[_piece]
+        VALUE_TABLE[_code + 6] = MG_VALUES[_piece[1]]
+
+PROMOTION_WEIGHT = np.ones((8, 8), np.int32) #a pawn move onto the last rank is four moves, one per promotion piece
+PROMOTION_WEIGHT[0] = PROMOTION_WEIGHT[7] = 4
+
+
+'''
+(N, 8, 8) int8 array of GameState-style boards (lists of piece strings)
+'''
+def encodeBoards(boards):
+    return np.array([[[PIECE_CODES[piece] for piece in row] for row in board] for board in boards],
+                    np.int8).reshape(-1, 8, 8)
+
+'''
+(N, 8, 8) int8 array of the piece placement field of FEN or EPD strings, without building GameStates
+'''
+def encodeFens(fens):
+    codes = []
+    for fen in fens:
+        for ch in fen.split(None, 1)[0]:
+            if ch.isdigit():
+                codes.extend([0] * int(ch))
+            elif ch != '/':
+                codes.append(FEN_CODES[ch])
+    return np.array(codes, np.int8).reshape(-1, 8, 8)
+
+'''
+One encoded board back to the 8x8 list of strings used by GameState
+'''
+def decodeBoard(board):
+    return [[CODE_PIECES[int(code)] for code in row] for row in board]
+
+
+'''
+Moves every board of a (N, 8, 8) array dr rows and dc columns, filling with zeros
+'''
+def shift(a, dr, dc):
+    out = np.zeros_like(a)
+    out[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        a[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return out
+
+'''
+Number of pieces attacking each square for pieces that jump by fixed steps (knights, kings, pawn captures)
+'''
+def stepAttacks(pieces, steps):
+    counts = np.zeros(pieces.shape, np.int8)
+    for dr, dc in steps:
+        counts += shift(pieces, dr, dc)
+    return counts
+
+'''
+Number of sliding pieces attacking each square. Each ray moves out one square at a time and stops after the first
+occupied square it reaches
+'''
+def slidingAttacks(pieces, empty, directions):
+    counts = np.zeros(pieces.shape, np.int8)
+    for dr, dc in directions:
+        ray = pieces
+        for i in range(7):
+            ray = shift(ray, dr, dc)
+            if not ray.any():
+                break
+            counts += ray
+            ray = ray * empty
+    return counts
+
+
+'''
+Features of a batch of encoded boards, as a dictionary of arrays:
+    occupancy   (N, 2, 8, 8) bool   squares holding a piece of each colour
+    attacks     (N, 2, 8, 8) int8   number of pieces of each colour attacking each square
+    mobility    (N, 2) int32        pseudo-legal moves of each colour
+    material    (N, 2) int32        middlegame piece values of each colour
+    inCheck     (N, 2) bool         whether each colour's king is attacked
+    evaluation  (N,) int32          Evaluation's tapered score from white's point of view
+'''
+def analyzeBatch(boards):
+    boards = np.asarray(boards, np.int8).reshape(-1, 8, 8)
+    n = len(boards)
+    occupancy = np.stack([boards > 0, boards < 0], axis=1)
+    empty = (boards == 0).astype(np.int8)
+    attacks = np.zeros((n, 2, 8, 8), np.int8)
+    mobility = np.zeros((n, 2), np.int32)
+    inCheck = np.zeros((n, 2), bool)
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        own = occupancy[:, color]
+        enemy = occupancy[:, 1 - color]
+        pieces = {kind: (boards == sign * kind).astype(np.int8) for kind in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)}
+        pieceAttacks = (stepAttacks(pieces[KNIGHT], KNIGHT_STEPS) + stepAttacks(pieces[KING], KING_STEPS)
+                        + slidingAttacks(pieces[BISHOP] + pieces[QUEEN], empty, BISHOP_DIRECTIONS)
+                        + slidingAttacks(pieces[ROOK] + pieces[QUEEN], empty, ROOK_DIRECTIONS))
+        forward = -sign #white pawns move towards row 0
+        pawnAttacks = stepAttacks(pieces[PAWN], [(forward, -1), (forward, 1)])
+        attacks[:, color] = pieceAttacks + pawnAttacks
+
+        single = shift(pieces[PAWN], forward, 0) * empty
+        double = shift(single * (np.arange(8) == (5 if color == WHITE else 2))[:, None], forward, 0) * empty
+        pawnMoves = (single + pawnAttacks * enemy) * PROMOTION_WEIGHT + double
+        mobility[:, color] = (pieceAttacks * ~own).sum(axis=(1, 2)) + pawnMoves.sum(axis=(1, 2))
+
+    for color in (WHITE, BLACK):
+        king = boards == (KING if color == WHITE else -KING)
+        inCheck[:, color] = (attacks[:, 1 - color] * king).any(axis=(1, 2))
+
+    index = boards.reshape(n, 64).astype(np.intp) + 6
+    squares = np.arange(64)
+    mg = MG_TABLE[index, squares].sum(axis=1)
+    eg = EG_TABLE[index, squares].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[index].sum(axis=1), MAX_PHASE)
+    values = VALUE_TABLE[index]
+    material = np.stack([(values * (index > 6)).sum(axis=1), (values * (index < 6)).sum(axis=1)], axis=1)
+    return {'occupancy': occupancy, 'attacks': attacks, 'mobility': mobility, 'material': material.astype(np.int32),
+            'inCheck': inCheck, 'evaluation': ((mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE).astype(np.int32)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ChessBot.Batch', description='Features of many positions with NumPy')
+    parser.add_argument('files', nargs='+', help='FEN/EPD files, one position per line')
+    parser.add_argument('--out', required=True, help='.npz file to write')
+    parser.add_argument('--chunk', type=int, default=100000, help='positions analysed per batch')
+    args = parser.parse_args(argv)
+
+    out = args.out if args.out.endswith('.npz') else args.out + '.npz' #the name np.savez would have used
+    start = time.perf_counter()
+    count = sum(1 for path in args.files for fen in readPositions(path)) #first pass, so the outputs can be sized
+    # every chunk is written straight into one memory-mapped .npy file per feature, so memory stays at one chunk
+    # however many positions there are, and the files are then stored in the .npz without being loaded again
+    folder = tempfile.mkdtemp(prefix='batch-', dir=os.path.dirname(os.path.abspath(out)))
+    try:
+        outputs = {}
+        fens = []
+        done = 0
+
+        def flush():
+            nonlocal done
+            boards = encodeFens(fens)
+            for name, array in dict(analyzeBatch(boards), boards=boards).items():
+                if name not in outputs:
+                    outputs[name] = np.lib.format.open_memmap(os.path.join(folder, name + '.npy'), 'w+', array.dtype,
+                                                              (count,) + array.shape[1:])
+                outputs[name][done:done + len(boards)] = array
+            done += len(boards)
+            fens.clear()
+
+        for path in args.files:
+            for fen in readPositions(path):
+                fens.append(fen)
+                if len(fens) >= args.chunk:
+                    flush()
+        if fens or not outputs:
+            flush()
+        names = list(outputs)
+        for array in outputs.values():
+            array.flush()
+        outputs.clear() #closes the maps before the files are copied
+        with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name in names:
+                archive.write(os.path.join(folder, name + '.npy'), name + '.npy')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    print(f'{count} positions in {elapsed:.2f}s ({count / elapsed if elapsed > 0 else 0:,.0f} positions/sec) -> {out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,399 @@
+# Bitboard version of the GameState. Instead of an 8x8 list of strings the position is stored as twelve 64-bit integers,
+# one per piece, plus occupancy masks for each side. Square index is row * 8 + col, so square 0 is a8 and square 63 is h1,
+# the same orientation as GameState.board. It supports the same makeMove/undoMove/getValidMoves API as GameState
+# and can be converted to and from the list board.
+
+from .ChessEngine import (GameState, Move, PROMOTION, EN_PASSANT, CASTLING, SPECIAL_MASK, PROMOTION_PIECES,
+                          WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE, ALL_CASTLING, CASTLING_MASKS,
+                          CASTLING_ROOKS)
+from .Attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAY_MASKS, BISHOP_RAY_MASKS, slidingAttacks
+
+PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WHITE = 0
+BLACK = 1
+
+FULL = (1 << 64) - 1
+RANK_8 = 0xFF # row 0
+RANK_1 = 0xFF << 56 # row 7
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+
+
+class BitboardState():
+    # Constructor: takes an 8x8 list board like GameState.board, defaults to the starting position
+    def __init__(self, board=None, whiteToMove=True, castlingRights=0, enPassantSquare=None):
+        if board is None:
+            board = GameState().board
+            castlingRights = ALL_CASTLING
+        self.pieceBoards = [0] * 12
+        self.squares = ['--'] * 64 #piece on each square, so captures can be found without testing twelve boards
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != '--':
+                    sq = r * 8 + c
+                    self.pieceBoards[PIECE_INDEX[piece]] |= 1 << sq
+                    self.squares[sq] = piece
+        self.colorBoards = [0, 0]
+        self.updateOccupancy()
+        self.whiteToMove = whiteToMove
+        self.castlingRights = castlingRights #same mask and en passant rule as GameState
+        self.enPassantSquare = enPassantSquare
+        self.moveLog = [] #packed moves, as in GameState
+        self.undoLog = [] #(piece or '--' captured, castlingRights, enPassantSquare) from before each move
+
+    '''
+    Builds a BitboardState from the position of an existing GameState
+    '''
+    @classmethod
+    def fromGameState(cls, gs):
+        return cls(gs.board, gs.whiteToMove, gs.castlingRights, gs.enPassantSquare)
+
+    '''
+    Converts back to the 8x8 list board used by GameState and ChessMain
+    '''
+    def toBoard(self):
+        return [self.squares[r * 8:r * 8 + 8] for r in range(8)]
+
+    def updateOccupancy(self):
+        self.colorBoards[WHITE] = 0
+        self.colorBoards[BLACK] = 0
+        for i in range(6):
+            self.colorBoards[WHITE] |= self.pieceBoards[i]
+            self.colorBoards[BLACK] |= self.pieceBoards[i + 6]
+        self.occupied = self.colorBoards[WHITE] | self.colorBoards[BLACK]
+
+    @property
+    def whiteKingLocation(self):
+        return divmod(self.pieceBoards[PIECE_INDEX['wK']].bit_length() - 1, 8)
+
+    @property
+    def blackKingLocation(self):
+        return divmod(self.pieceBoards[PIECE_INDEX['bK']].bit_length() - 1, 8)
+
+    '''
+    Takes a move as a parameter and executes it, same rules as GameState.makeMove
+    '''
+    def makeMove(self, move):
+        self.makeMoveCode(move.moveID)
+
+    def makeMoveCode(self, code):
+        start = code & 63
+        end = (code >> 6) & 63
+        pieceMoved = self.squares[start]
+        pieceCaptured = self.squares[end]
+        moved = PIECE_INDEX[pieceMoved]
+        side = WHITE if moved < 6 else BLACK
+        self.moveLog.append(code)
+        self.undoLog.append((pieceCaptured, self.castlingRights, self.enPassantSquare))
+        if pieceCaptured != '--':
+            self.removePiece(pieceCaptured, end)
+        self.removePiece(pieceMoved, start)
+        special = code & SPECIAL_MASK
+        if special == PROMOTION:
+            self.addPiece(pieceMoved[0] + PROMOTION_PIECES[(code >> 12) & 3], end)
+        else:
+            self.addPiece(pieceMoved, end)
+            if special == EN_PASSANT:
+                self.removePiece(self.squares[(start & ~7) | (end & 7)], (start & ~7) | (end & 7))
+            elif special == CASTLING:
+                rookStart, rookEnd = CASTLING_ROOKS[end]
+                rook = self.squares[rookStart]
+                self.removePiece(rook, rookStart)
+                self.addPiece(rook, rookEnd)
+        self.occupied = self.colorBoards[WHITE] | self.colorBoards[BLACK]
+        self.castlingRights &= CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        self.enPassantSquare = None
+        if moved == side * 6 and (end - start == 16 or start - end == 16):
+            # the square behind the pawn, only when an enemy pawn is there to take it
+            if PAWN_ATTACKS[side][(start + end) // 2] & self.pieceBoards[(1 - side) * 6]:
+                self.enPassantSquare = (start + end) // 2
+        self.whiteToMove = not self.whiteToMove
+
+    '''
+    This will undo the previous move
+    '''
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            code = self.moveLog.pop()
+            pieceCaptured, self.castlingRights, self.enPassantSquare = self.undoLog.pop()
+            start = code & 63
+            end = (code >> 6) & 63
+            pieceMoved = self.squares[end]
+            self.removePiece(pieceMoved, end)
+            special = code & SPECIAL_MASK
+            if special == PROMOTION:
+                pieceMoved = pieceMoved[0] + 'p'
+            elif special == EN_PASSANT:
+                self.addPiece('bp' if pieceMoved[0] == 'w' else 'wp', (start & ~7) | (end & 7))
+            elif special == CASTLING:
+                rookStart, rookEnd = CASTLING_ROOKS[end]
+                rook = self.squares[rookEnd]
+                self.removePiece(rook, rookEnd)
+                self.addPiece(rook, rookStart)
+            self.addPiece(pieceMoved, start)
+            if pieceCaptured != '--':
+                self.addPiece(pieceCaptured, end)
+            self.occupied = self.colorBoards[WHITE] | self.colorBoards[BLACK]
+            self.whiteToMove = not self.whiteToMove
+
+    '''
+    Take a piece off / put a piece on a square, keeping the piece, colour and square boards in step. The caller updates
+    occupied once the whole move is done
+    '''
+    def removePiece(self, piece, sq):
+        index = PIECE_INDEX[piece]
+        self.pieceBoards[index] ^= 1 << sq
+        self.colorBoards[index // 6] ^= 1 << sq
+        self.squares[sq] = '--'
+
+    def addPiece(self, piece, sq):
+        index = PIECE_INDEX[piece]
+        self.pieceBoards[index] |= 1 << sq
+        self.colorBoards[index // 6] |= 1 << sq
+        self.squares[sq] = piece
+
+    '''
+    Move view of a packed move in the current position
+    '''
+    def moveFromCode(self, code):
+        pieceMoved = self.squares[code & 63]
+        if code & SPECIAL_MASK == EN_PASSANT:
+            return Move.fromCode(code, pieceMoved, 'bp' if pieceMoved[0] == 'w' else 'wp')
+        return Move.fromCode(code, pieceMoved, self.squares[(code >> 6) & 63])
+
+    '''
+    All moves considering checks
+    '''
+    def getValidMoves(self):
+        return [self.moveFromCode(code) for code in self.getValidMoveCodes()]
+
+    '''
+    Legal moves from checks and pins, the same approach as GameState.getLegalMoves: a move is kept without being made if
+    it ends on checkMask (anywhere when not in check, the checker or a square between it and the king when in single
+    check) and a pinned piece stays on its pin ray. King moves test their end square with the king lifted off the board,
+    and only en passant, which can uncover a check along the rank, is made and tested
+    '''
+    def getValidMoveCodes(self):
+        side = WHITE if self.whiteToMove else BLACK
+        enemy = 1 - side
+        king = self.pieceBoards[side * 6 + 5].bit_length() - 1
+        kingBit = 1 << king
+        checkers = self.attackers(king, enemy)
+        if checkers & (checkers - 1): #double check, only the king can move
+            checkMask = 0
+        elif checkers:
+            checkMask = checkers | self.between(king, checkers.bit_length() - 1)
+        else:
+            checkMask = FULL
+        pins = self.getPins(king, side)
+        validMoves = []
+        for code in self.getAllPossibleMoveCodes():
+            start = code & 63
+            end = (code >> 6) & 63
+            special = code & SPECIAL_MASK
+            if start == king:
+                if special != CASTLING: #a king stepping away along a checking ray is still attacked
+                    self.occupied ^= kingBit
+                attacked = self.isAttacked(end, enemy)
+                if special != CASTLING:
+                    self.occupied ^= kingBit
+                if not attacked:
+                    validMoves.append(code)
+            elif special == EN_PASSANT:
+                self.makeMoveCode(code)
+                self.whiteToMove = not self.whiteToMove
+                if not self.inCheck():
+                    validMoves.append(code)
+                self.whiteToMove = not self.whiteToMove
+                self.undoMove()
+            elif checkMask >> end & 1 and (start not in pins or pins[start] >> end & 1):
+                validMoves.append(code)
+        return validMoves
+
+    '''
+    Pinned pieces of side as {square: squares it can still move to}, the ray from the king up to and including the pinner
+    '''
+    def getPins(self, king, side):
+        pins = {}
+        pb = self.pieceBoards
+        own = self.colorBoards[side]
+        base = (1 - side) * 6
+        queens = pb[base + 4]
+        for rays, sliders in ((ROOK_RAY_MASKS, pb[base + 3] | queens), (BISHOP_RAY_MASKS, pb[base + 2] | queens)):
+            for ray, positive in rays:
+                mask = ray[king]
+                if not mask & sliders:
+                    continue
+                blockers = mask & self.occupied
+                first = blockers & -blockers if positive else 1 << (blockers.bit_length() - 1)
+                if not first & own:
+                    continue
+                blockers ^= first
+                if not blockers:
+                    continue
+                second = blockers & -blockers if positive else 1 << (blockers.bit_length() - 1)
+                if second & sliders:
+                    pins[first.bit_length() - 1] = mask ^ ray[second.bit_length() - 1]
+        return pins
+
+    '''
+    Squares between a and b on a shared rank, file or diagonal, with b included. 0 if they don't share one
+    '''
+    def between(self, a, b):
+        for rays in (ROOK_RAY_MASKS, BISHOP_RAY_MASKS):
+            for ray, positive in rays:
+                if ray[a] >> b & 1:
+                    return ray[a] ^ ray[b]
+        return 0
+
+    '''
+    will determine if the current player is in check
+    '''
+    def inCheck(self):
+        side = WHITE if self.whiteToMove else BLACK
+        king = self.pieceBoards[side * 6 + 5]
+        return self.isAttacked(king.bit_length() - 1, 1 - side)
+
+    '''
+    determine if the enemy can attack the square r, c
+    '''
+    def squareUnderAttack(self, r, c):
+        return self.isAttacked(r * 8 + c, BLACK if self.whiteToMove else WHITE)
+
+    '''
+    True if any piece of colour byColor attacks sq. Looks outward from sq with each piece's attack pattern instead of
+    generating the opponent's moves
+    '''
+    def isAttacked(self, sq, byColor):
+        base = byColor * 6
+        pb = self.pieceBoards
+        if KNIGHT_ATTACKS[sq] & pb[base + 1]:
+            return True
+        if KING_ATTACKS[sq] & pb[base + 5]:
+            return True
+        if PAWN_ATTACKS[1 - byColor][sq] & pb[base]: #a pawn attacks sq if a pawn of the other colour on sq would attack it
+            return True
+        queens = pb[base + 4]
+        if slidingAttacks(sq, self.occupied, ROOK_RAY_MASKS) & (pb[base + 3] | queens):
+            return True
+        if slidingAttacks(sq, self.occupied, BISHOP_RAY_MASKS) & (pb[base + 2] | queens):
+            return True
+        return False
+
+    '''
+    Board of the pieces of colour byColor that attack sq
+    '''
+    def attackers(self, sq, byColor):
+        base = byColor * 6
+        pb = self.pieceBoards
+        queens = pb[base + 4]
+        return ((KNIGHT_ATTACKS[sq] & pb[base + 1]) | (KING_ATTACKS[sq] & pb[base + 5])
+                | (PAWN_ATTACKS[1 - byColor][sq] & pb[base])
+                | (slidingAttacks(sq, self.occupied, ROOK_RAY_MASKS) & (pb[base + 3] | queens))
+                | (slidingAttacks(sq, self.occupied, BISHOP_RAY_MASKS) & (pb[base + 2] | queens)))
+
+    """
+    All moves without considering checks
+    """
+    def getAllPossibleMoves(self):
+        return [self.moveFromCode(code) for code in self.getAllPossibleMoveCodes()]
+
+    def getAllPossibleMoveCodes(self):
+        moves = []
+        side = WHITE if self.whiteToMove else BLACK
+        base = side * 6
+        own = self.colorBoards[side]
+        targets = FULL ^ own
+        occupied = self.occupied
+        pb = self.pieceBoards
+
+        self.getPawnMoves(side, moves)
+        self.addMoves(pb[base + 1], lambda sq: KNIGHT_ATTACKS[sq] & targets, moves)
+        self.addMoves(pb[base + 2], lambda sq: slidingAttacks(sq, occupied, BISHOP_RAY_MASKS) & targets, moves)
+        self.addMoves(pb[base + 3], lambda sq: slidingAttacks(sq, occupied, ROOK_RAY_MASKS) & targets, moves)
+        self.addMoves(pb[base + 4], lambda sq: (slidingAttacks(sq, occupied, ROOK_RAY_MASKS) |
+                                                slidingAttacks(sq, occupied, BISHOP_RAY_MASKS)) & targets, moves)
+        self.addMoves(pb[base + 5], lambda sq: KING_ATTACKS[sq] & targets, moves)
+        self.getCastleMoves(side, moves)
+        return moves
+
+    '''
+    Castling moves, same rules as GameState.getCastleMoves
+    '''
+    def getCastleMoves(self, side, moves):
+        if side == WHITE:
+            kingside, queenside, king = WHITE_KINGSIDE, WHITE_QUEENSIDE, 60
+        else:
+            kingside, queenside, king = BLACK_KINGSIDE, BLACK_QUEENSIDE, 4
+        rights = self.castlingRights
+        rooks = self.pieceBoards[side * 6 + 3]
+        if not rights & (kingside | queenside) or not self.pieceBoards[side * 6 + 5] >> king & 1:
+            return
+        occupied = self.occupied
+        if (rights & kingside and not occupied & (3 << king + 1) and rooks >> king + 3 & 1
+                and not self.isAttacked(king, 1 - side) and not self.isAttacked(king + 1, 1 - side)):
+            moves.append(king | (king + 2) << 6 | CASTLING)
+        if (rights & queenside and not occupied & (7 << king - 3) and rooks >> king - 4 & 1
+                and not self.isAttacked(king, 1 - side) and not self.isAttacked(king - 1, 1 - side)):
+            moves.append(king | (king - 2) << 6 | CASTLING)
+
+    '''
+    Adds a move for every piece on pieces to every square of attacksFrom(sq)
+    '''
+    def addMoves(self, pieces, attacksFrom, moves):
+        while pieces:
+            bit = pieces & -pieces
+            start = bit.bit_length() - 1
+            pieces ^= bit
+            targets = attacksFrom(start)
+            while targets:
+                bit = targets & -targets
+                end = bit.bit_length() - 1
+                targets ^= bit
+                moves.append(start | end << 6)
+
+    '''
+    Pawn pushes and captures for the whole side at once, by shifting the pawn board. En passant captures come from the
+    pawns a pawn of the other colour on the en passant square would attack
+    '''
+    def getPawnMoves(self, side, moves):
+        pawns = self.pieceBoards[side * 6]
+        empty = FULL ^ self.occupied
+        enemy = self.colorBoards[1 - side]
+        if side == WHITE: #white pawns move towards row 0, which is a shift to lower squares
+            single = (pawns >> 8) & empty
+            double = ((single & (0xFF << 40)) >> 8) & empty #pawns that pushed from row 6 onto row 5
+            left = ((pawns & ~FILE_A) >> 9) & enemy
+            right = ((pawns & ~FILE_H) >> 7) & enemy
+            self.addPawnMoves(single, 8, moves)
+            self.addPawnMoves(double, 16, moves)
+            self.addPawnMoves(left, 9, moves)
+            self.addPawnMoves(right, 7, moves)
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & (0xFF << 16)) << 8) & empty
+            left = ((pawns & ~FILE_A) << 7) & enemy & FULL
+            right = ((pawns & ~FILE_H) << 9) & enemy & FULL
+            self.addPawnMoves(single, -8, moves)
+            self.addPawnMoves(double, -16, moves)
+            self.addPawnMoves(left, -7, moves)
+            self.addPawnMoves(right, -9, moves)
+        if self.enPassantSquare is not None:
+            takers = PAWN_ATTACKS[1 - side][self.enPassantSquare] & pawns
+            while takers:
+                bit = takers & -takers
+                takers ^= bit
+                moves.append((bit.bit_length() - 1) | self.enPassantSquare << 6 | EN_PASSANT)
+
+    def addPawnMoves(self, targets, offset, moves):
+        while targets:
+            bit = targets & -targets
+            end = bit.bit_length() - 1
+            targets ^= bit
+            if bit & (RANK_8 | RANK_1): #one move per promotion piece, queen first
+                for i in range(len(PROMOTION_PIECES) - 1, -1, -1):
+                    moves.append((end + offset) | end << 6 | PROMOTION | i << 12)
+            else:
+                moves.append((end + offset) | end << 6)
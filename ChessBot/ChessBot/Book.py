@@ -0,0 +1,236 @@
+# Opening book and endgame table probing. Both are files of sorted fixed-size records that are searched in place through
+# mmap, so opening one costs nothing, a probe is a binary search over the keys (a few microseconds), and every process
+# that opens the same file shares the operating system's page cache instead of loading its own copy.
+#
+#   OpeningBook     Polyglot .bin book (the format most engines and GUIs use): 16-byte records of
+#                   key u64, move u16, weight u16, learn u32, big-endian, sorted by key
+#   EndgameTable    the same layout with key u64, move u16, distance i16 and 4 spare bytes. distance is in plies from the
+#                   side to move: > 0 it mates in that many plies, < 0 it is mated, 0 is a draw
+#
+# Both are keyed by polyglotKey (not GameState.zobristKey) so books made by other programs can be read.
+#
+#   python -m ChessBot.Book book.bin --fen "<fen>"
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+from .ChessEngine import (GameState, PROMOTION, SPECIAL_MASK, CASTLING, WHITE_KINGSIDE, WHITE_QUEENSIDE,
+                          BLACK_KINGSIDE, BLACK_QUEENSIDE)
+from .PolyglotRandom import RANDOM64
+
+RECORD_SIZE = 16
+BOOK_RECORD = struct.Struct('>QHHI')
+TABLE_RECORD = struct.Struct('>QHh4x')
+KEY = struct.Struct('>Q')
+
+# index of each piece in RANDOM64, in 64-square blocks
+PIECE_KINDS = {'bp': 0, 'wp': 1, 'bN': 2, 'wN': 3, 'bB': 4, 'wB': 5, 'bR': 6, 'wR': 7, 'bQ': 8, 'wQ': 9, 'bK': 10, 'wK': 11}
+CASTLING_RIGHTS = [WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE]
+
+
+'''
+Polyglot hash of a position. GameState only keeps the en passant square when a pawn can take, which is the rule
+Polyglot uses too
+'''
+def polyglotKey(gs):
+    key = 0
+    for r in range(8):
+        row = gs.board[r]
+        for c in range(8):
+            piece = row[c]
+            if piece != '--':
+                key ^= RANDOM64[64 * PIECE_KINDS[piece] + 8 * (7 - r) + c]
+    for i, right in enumerate(CASTLING_RIGHTS):
+        if gs.castlingRights & right:
+            key ^= RANDOM64[768 + i]
+    if gs.enPassantSquare is not None:
+        key ^= RANDOM64[772 + (gs.enPassantSquare & 7)]
+    if gs.whiteToMove:
+        key ^= RANDOM64[780]
+    return key
+
+
+'''
+Packed move (see ChessEngine) for a Polyglot move in this position, or None if it isn't one of validCodes. Polyglot
+writes castling as the king taking its own rook and counts promotion pieces from 1
+'''
+def decodeMove(gs, move, validCodes):
+    start = (7 - ((move >> 9) & 7)) * 8 + ((move >> 6) & 7)
+    end = (7 - ((move >> 3) & 7)) * 8 + (move & 7)
+    promotion = (move >> 12) & 7
+    if gs.board[start >> 3][start & 7][1:] == 'K' and start & 7 == 4 and end >> 3 == start >> 3 and end & 7 in (0, 7):
+        end = start + 2 if end & 7 == 7 else start - 2
+    for code in validCodes:
+        if code & 0xFFF == start | end << 6:
+            if not promotion or (code & SPECIAL_MASK == PROMOTION and (code >> 12) & 3 == promotion - 1):
+                return code
+    return None
+
+'''
+Polyglot move for a packed move, the inverse of decodeMove
+'''
+def encodeMove(code):
+    start = code & 63
+    end = (code >> 6) & 63
+    if code & SPECIAL_MASK == CASTLING:
+        end = end + 1 if end & 7 == 6 else end - 2 #onto the rook
+    move = (7 - (start >> 3)) << 9 | (start & 7) << 6 | (7 - (end >> 3)) << 3 | (end & 7)
+    if code & SPECIAL_MASK == PROMOTION:
+        move |= (((code >> 12) & 3) + 1) << 12
+    return move
+
+
+class MappedTable():
+    record = BOOK_RECORD
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        self.file = open(self.path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD_SIZE:
+            self.file.close()
+            raise ValueError(f'{self.path} is not a whole number of {RECORD_SIZE}-byte records')
+        self.count = size // RECORD_SIZE
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b'' #empty files can't be mapped
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # pickled as the path alone, so a table handed to a worker process is mapped again there and shares the page cache
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.open()
+
+    '''
+    Every record with this key, found by binary search for the first one
+    '''
+    def records(self, key):
+        data = self.data
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if KEY.unpack_from(data, mid * RECORD_SIZE)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        records = []
+        while lo < self.count:
+            record = self.record.unpack_from(data, lo * RECORD_SIZE)
+            if record[0] != key:
+                break
+            records.append(record)
+            lo += 1
+        return records
+
+
+class OpeningBook(MappedTable):
+    record = BOOK_RECORD
+
+    '''
+    Legal book moves of the position as (packed move, weight), highest weight first
+    '''
+    def probe(self, gs):
+        records = self.records(polyglotKey(gs))
+        if not records:
+            return []
+        validCodes = gs.getValidMoveCodes()
+        moves = []
+        for key, move, weight, learn in records:
+            code = decodeMove(gs, move, validCodes)
+            if code is not None:
+                moves.append((code, weight))
+        moves.sort(key=lambda entry: -entry[1])
+        return moves
+
+    '''
+    Packed book move to play, or None when the position is out of book. Without rng the highest weight is played,
+    with a random.Random the move is picked in proportion to its weight
+    '''
+    def chooseMove(self, gs, rng=None):
+        moves = self.probe(gs)
+        if not moves:
+            return None
+        total = sum(weight for code, weight in moves)
+        if rng is None or total == 0:
+            return moves[0][0]
+        pick = rng.randrange(total)
+        for code, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return code
+        return moves[0][0]
+
+
+class EndgameTable(MappedTable):
+    record = TABLE_RECORD
+
+    '''
+    (packed best move, distance in plies) for the position, or None if it isn't in the table
+    '''
+    def probe(self, gs):
+        records = self.records(polyglotKey(gs))
+        if not records:
+            return None
+        key, move, distance = records[0]
+        code = decodeMove(gs, move, gs.getValidMoveCodes())
+        return (code, distance) if code is not None else None
+
+
+'''
+Writes records (tuples in the order of the record struct, key first) sorted by key, the layout MappedTable expects
+'''
+def writeRecords(path, record, records):
+    with open(path, 'wb') as f:
+        for values in sorted(records):
+            f.write(record.pack(*values))
+
+'''
+Book of (gs, packed move, weight) entries, as a Polyglot file
+'''
+def writeBook(path, entries):
+    writeRecords(path, BOOK_RECORD, ((polyglotKey(gs), encodeMove(code), weight, 0) for gs, code, weight in entries))
+
+'''
+Endgame table of (gs, packed best move, distance) entries
+'''
+def writeEndgameTable(path, entries):
+    writeRecords(path, TABLE_RECORD, ((polyglotKey(gs), encodeMove(code), distance) for gs, code, distance in entries))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ChessBot.Book', description='List the book moves of a position')
+    parser.add_argument('book', help='Polyglot .bin file')
+    parser.add_argument('--fen', default=None, help='position to look up, defaults to the starting position')
+    args = parser.parse_args(argv)
+
+    gs = GameState.fromFen(args.fen) if args.fen else GameState()
+    with OpeningBook(args.book) as book:
+        print(f'key {polyglotKey(gs):016x}, {book.count} entries')
+        moves = book.probe(gs)
+        total = sum(weight for code, weight in moves) or 1
+        for code, weight in moves:
+            print(f'{gs.moveFromCode(code).getChessNotation()} weight {weight} ({100 * weight / total:.1f}%)')
+        if not moves:
+            print('out of book')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
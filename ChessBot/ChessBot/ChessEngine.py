@@ -1,6 +1,56 @@
 # This class is responsible for storing all the information about the current state of a chess game. IT will also be responsible for 
 # determining the valid moves at the current state. It will also keep a move log. 
 
+import collections
+import re
+from array import array
+
+from .Attacks import isSquareAttacked, KNIGHT_TARGETS, KING_TARGETS, PAWN_TARGETS, ROOK_RAYS, BISHOP_RAYS
+from .Zobrist import PIECE_KEYS, SIDE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS, hashPosition
+from .Evaluation import MG_SCORES, EG_SCORES, PHASE, scoreBoard
+
+# Moves are packed into 16-bit integers for generation and search (Move is only a view of one, for the UI):
+#   bits 0-5    start square (row * 8 + col)
+#   bits 6-11   end square
+#   bits 12-13  promotion piece, an index into PROMOTION_PIECES
+#   bits 14-15  special move type: NORMAL, PROMOTION, EN_PASSANT or CASTLING
+NORMAL = 0
+PROMOTION = 1 << 14
+EN_PASSANT = 2 << 14
+CASTLING = 3 << 14
+SPECIAL_MASK = 3 << 14
+PROMOTION_PIECES = ['N', 'B', 'R', 'Q']
+
+# Castling rights are a 4-bit mask
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+CASTLING_FEN = [(WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'), (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q')]
+# rights kept by a move that starts or ends on each square: moving a king or rook, or capturing a rook, loses them
+CASTLING_MASKS = [ALL_CASTLING] * 64
+CASTLING_MASKS[60] = ALL_CASTLING ^ (WHITE_KINGSIDE | WHITE_QUEENSIDE) #e1
+CASTLING_MASKS[63] = ALL_CASTLING ^ WHITE_KINGSIDE #h1
+CASTLING_MASKS[56] = ALL_CASTLING ^ WHITE_QUEENSIDE #a1
+CASTLING_MASKS[4] = ALL_CASTLING ^ (BLACK_KINGSIDE | BLACK_QUEENSIDE) #e8
+CASTLING_MASKS[7] = ALL_CASTLING ^ BLACK_KINGSIDE #h8
+CASTLING_MASKS[0] = ALL_CASTLING ^ BLACK_QUEENSIDE #a8
+# king's end square of a castling move -> (rook start square, rook end square)
+CASTLING_ROOKS = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+# keys of the last HISTORY_SIZE positions are kept for repetition checks. Only positions since the last capture or pawn
+# move can repeat, and a game is drawn after 100 of those, so this covers them with room for a search on top
+HISTORY_SIZE = 256 #power of two, so the ring buffer index is a mask
+HISTORY_MASK = HISTORY_SIZE - 1
+
+# piece, start file, start rank, end square, promotion piece (the capture mark is optional and not needed)
+SAN_PATTERN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+
+FEN_PIECES = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+              'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+PIECE_FEN = {v: k for k, v in FEN_PIECES.items()}
+
 class GameState():
     # Constructor:
     def __init__(self):
@@ -30,30 +80,221 @@ class GameState():
         #     ['--', '--', '--', '--', '--', '--', 'bp', '--'],
         #     ['wR', '--', '--', '--', '--', '--', '--', 'wR'],
         # ]
-        
+        # any other position can be loaded with GameState.fromFen
 
-        self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves, 
-                              'B': self.getBishopMoves, 'K': self.getKingMoves, 'Q': self.getQueenMoves}
-        self.whiteToMove = True
-        self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
+        self.setPosition(self.board, True, castlingRights=ALL_CASTLING)
 
     '''
-    Takes a move as a parameter and executes it. This will not work for castling, Enpassant, pawn promotion.
+    Sets up everything that follows from the board: side to move, castling rights, en passant square, king locations,
+    move counters, empty logs, the hash and the evaluation scores
+    '''
+    def setPosition(self, board, whiteToMove, halfmoveClock=0, fullmoveNumber=1, castlingRights=0, enPassantSquare=None):
+        self.board = board
+        self.whiteToMove = whiteToMove
+        self.castlingRights = castlingRights #mask of WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE
+        self.enPassantSquare = enPassantSquare #square a pawn can capture en passant onto, None if there is none
+        self.moveLog = [] #packed moves, see makeMoveCode
+        self.undoLog = [] #one undo record per move in moveLog, see makeMoveCode
+        self.halfmoveClock = halfmoveClock #moves since the last capture or pawn move
+        self.fullmoveNumber = fullmoveNumber #starts at 1, goes up after every black move
+        self.whiteKingLocation = None
+        self.blackKingLocation = None
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+        self.moveGenerator = 'legal' #'legal' finds checks and pins once per position, 'filter' makes and tests every move
+        self.zobristKey = hashPosition(board, whiteToMove, castlingRights, enPassantSquare) #updated by makeMove/undoMove
+        # material plus piece-square scores from white's point of view and the game phase, see Evaluation
+        self.mgScore, self.egScore, self.phase = scoreBoard(board) #updated incrementally by makeMove/undoMove
+        self.ply = 0 #moves made since setPosition
+        self.keyHistory = array('Q', bytes(8 * HISTORY_SIZE)) #ring buffer, keyHistory[ply & HISTORY_MASK] = zobristKey
+        self.keyHistory[0] = self.zobristKey
+        self.debugHash = False #when True every makeMove/undoMove checks zobristKey and the scores against a full recompute
+
+    '''
+    Builds a GameState from a FEN string without setting up the starting position first
+    '''
+    @classmethod
+    def fromFen(cls, fen):
+        fields = fen.split()
+        if not fields:
+            raise ValueError('empty FEN')
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError(f'FEN needs 8 ranks: {fen!r}')
+        board = []
+        for rank in ranks:
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(['--'] * int(ch))
+                elif ch in FEN_PIECES:
+                    row.append(FEN_PIECES[ch])
+                else:
+                    raise ValueError(f'bad FEN piece {ch!r}: {fen!r}')
+            if len(row) != 8:
+                raise ValueError(f'FEN rank {rank!r} is not 8 squares: {fen!r}')
+            board.append(row)
+        if any(piece[1] == 'p' for piece in board[0] + board[7]):
+            raise ValueError(f'FEN has a pawn on the first or last rank: {fen!r}')
+        for king in ('wK', 'bK'):
+            count = sum(row.count(king) for row in board)
+            if count != 1:
+                raise ValueError(f'FEN has {count} {"white" if king == "wK" else "black"} kings: {fen!r}')
+        if len(fields) > 1 and fields[1] not in ('w', 'b'):
+            raise ValueError(f'bad FEN side to move {fields[1]!r}: {fen!r}')
+        whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        castlingRights = 0
+        if len(fields) > 2:
+            if fields[2] != '-' and (not fields[2] or any(ch not in 'KQkq' for ch in fields[2])):
+                raise ValueError(f'bad FEN castling field {fields[2]!r}: {fen!r}')
+            for right, letter in CASTLING_FEN:
+                if letter in fields[2]:
+                    castlingRights |= right
+        enPassantSquare = None
+        if len(fields) > 3 and fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in Move.filesToCol or fields[3][1] != ('6' if whiteToMove else '3'):
+                raise ValueError(f'bad FEN en passant square {fields[3]!r}: {fen!r}')
+            c = Move.filesToCol[fields[3][0]]
+            r = 3 if whiteToMove else 4 #row of the pawn that just moved two squares
+            step = -1 if whiteToMove else 1 #towards the rows it passed over and started from
+            if (board[r][c] != ('bp' if whiteToMove else 'wp') or board[r + step][c] != '--'
+                    or board[r + 2 * step][c] != '--'):
+                raise ValueError(f'FEN en passant square {fields[3]!r} does not follow a two-square pawn move: {fen!r}')
+            pawn = 'wp' if whiteToMove else 'bp'
+            # only kept if a pawn can take, the same rule as makeMoveCode, so equal positions get equal hashes
+            if (c > 0 and board[r][c - 1] == pawn) or (c < 7 and board[r][c + 1] == pawn):
+                enPassantSquare = (r - 1 if whiteToMove else r + 1) * 8 + c
+        gs = cls.__new__(cls)
+        gs.setPosition(board, whiteToMove, int(fields[4]) if len(fields) > 4 else 0,
+                       int(fields[5]) if len(fields) > 5 else 1, castlingRights, enPassantSquare)
+        return gs
+
+    '''
+    FEN string of the current position
+    '''
+    def toFen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += PIECE_FEN[piece]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = ''.join(letter for right, letter in CASTLING_FEN if self.castlingRights & right) or '-'
+        if self.enPassantSquare is None:
+            enPassant = '-'
+        else:
+            enPassant = Move.colToFiles[self.enPassantSquare & 7] + Move.rowsToRanks[self.enPassantSquare >> 3]
+        return (f"{'/'.join(ranks)} {'w' if self.whiteToMove else 'b'} {castling} {enPassant} "
+                f"{self.halfmoveClock} {self.fullmoveNumber}")
+
+    '''
+    Takes a move as a parameter and executes it, including castling, en passant and pawn promotion
     '''
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move)
+        self.makeMoveCode(move.moveID)
+
+    '''
+    makeMove for a packed move. The move log keeps the packed move, and the undo log a record of everything the move
+    can't restore by itself: (piece or '--' captured, halfmoveClock, castlingRights, enPassantSquare, zobristKey,
+    mgScore, egScore, phase) from before the move. undoMove puts those back as they were instead of working them out
+    again. The hash and the scores are updated here from the squares that changed
+    '''
+    def makeMoveCode(self, code):
+        board = self.board
+        start = code & 63
+        end = (code >> 6) & 63
+        sr, sc = start >> 3, start & 7
+        er, ec = end >> 3, end & 7
+        pieceMoved = board[sr][sc]
+        pieceCaptured = board[er][ec]
+        self.moveLog.append(code)
+        self.undoLog.append((pieceCaptured, self.halfmoveClock, self.castlingRights, self.enPassantSquare,
+                             self.zobristKey, self.mgScore, self.egScore, self.phase))
+        board[sr][sc] = "--"
+        board[er][ec] = pieceMoved
+        keys = PIECE_KEYS[pieceMoved]
+        key = self.zobristKey ^ keys[sr][sc] ^ keys[er][ec] ^ SIDE_KEY
+        scores = MG_SCORES[pieceMoved]
+        mg = self.mgScore + scores[er][ec] - scores[sr][sc]
+        scores = EG_SCORES[pieceMoved]
+        eg = self.egScore + scores[er][ec] - scores[sr][sc]
+        if pieceCaptured != '--':
+            key ^= PIECE_KEYS[pieceCaptured][er][ec]
+            mg -= MG_SCORES[pieceCaptured][er][ec]
+            eg -= EG_SCORES[pieceCaptured][er][ec]
+            self.phase -= PHASE[pieceCaptured]
+
+        special = code & SPECIAL_MASK
+        if special == PROMOTION:
+            promoted = pieceMoved[0] + PROMOTION_PIECES[(code >> 12) & 3]
+            board[er][ec] = promoted
+            key ^= PIECE_KEYS[pieceMoved][er][ec] ^ PIECE_KEYS[promoted][er][ec]
+            mg += MG_SCORES[promoted][er][ec] - MG_SCORES[pieceMoved][er][ec]
+            eg += EG_SCORES[promoted][er][ec] - EG_SCORES[pieceMoved][er][ec]
+            self.phase += PHASE[promoted]
+        elif special == EN_PASSANT: #the captured pawn is beside the start square, not on the end square
+            pawn = board[sr][ec]
+            board[sr][ec] = '--'
+            key ^= PIECE_KEYS[pawn][sr][ec]
+            mg -= MG_SCORES[pawn][sr][ec]
+            eg -= EG_SCORES[pawn][sr][ec]
+        elif special == CASTLING: #the king has moved two squares, now move the rook over it
+            rookStart, rookEnd = CASTLING_ROOKS[end]
+            rook = board[sr][rookStart & 7]
+            board[sr][rookStart & 7] = '--'
+            board[sr][rookEnd & 7] = rook
+            keys = PIECE_KEYS[rook]
+            key ^= keys[sr][rookStart & 7] ^ keys[sr][rookEnd & 7]
+            mg += MG_SCORES[rook][sr][rookEnd & 7] - MG_SCORES[rook][sr][rookStart & 7]
+            eg += EG_SCORES[rook][sr][rookEnd & 7] - EG_SCORES[rook][sr][rookStart & 7]
+
+        rights = self.castlingRights & CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        if rights != self.castlingRights:
+            key ^= CASTLING_KEYS[self.castlingRights] ^ CASTLING_KEYS[rights]
+            self.castlingRights = rights
+        if self.enPassantSquare is not None:
+            key ^= EN_PASSANT_KEYS[self.enPassantSquare & 7]
+            self.enPassantSquare = None
+        if pieceMoved[1] == 'p':
+            self.halfmoveClock = 0
+            if er - sr == 2 or sr - er == 2:
+                # the square behind the pawn, only when an enemy pawn is there to take it
+                enemyPawn = 'bp' if pieceMoved[0] == 'w' else 'wp'
+                if (ec > 0 and board[er][ec - 1] == enemyPawn) or (ec < 7 and board[er][ec + 1] == enemyPawn):
+                    self.enPassantSquare = (sr + er) // 2 * 8 + ec
+                    key ^= EN_PASSANT_KEYS[ec]
+        elif pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if pieceMoved[0] == 'b':
+            self.fullmoveNumber += 1
         self.whiteToMove = not self.whiteToMove #changes player to move
         #update the kings location if moved
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
-            
-        
+        if pieceMoved == 'wK':
+            self.whiteKingLocation = (er, ec)
+        elif pieceMoved == 'bK':
+            self.blackKingLocation = (er, ec)
+        self.zobristKey = key
+        self.mgScore = mg
+        self.egScore = eg
+        self.ply += 1
+        self.keyHistory[self.ply & HISTORY_MASK] = key
+        if self.debugHash:
+            self.checkHash()
 
 
     '''
@@ -61,26 +302,197 @@ class GameState():
     '''
     def undoMove(self):
         if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            code = self.moveLog.pop()
+            (pieceCaptured, self.halfmoveClock, self.castlingRights, self.enPassantSquare,
+             self.zobristKey, self.mgScore, self.egScore, self.phase) = self.undoLog.pop()
+            board = self.board
+            start = code & 63
+            end = (code >> 6) & 63
+            sr, sc = start >> 3, start & 7
+            er, ec = end >> 3, end & 7
+            pieceMoved = board[er][ec]
+            special = code & SPECIAL_MASK
+            if special == PROMOTION:
+                pieceMoved = pieceMoved[0] + 'p'
+            elif special == EN_PASSANT:
+                board[sr][ec] = 'bp' if pieceMoved[0] == 'w' else 'wp'
+            elif special == CASTLING:
+                rookStart, rookEnd = CASTLING_ROOKS[end]
+                board[sr][rookStart & 7] = board[sr][rookEnd & 7]
+                board[sr][rookEnd & 7] = '--'
+            board[sr][sc] = pieceMoved
+            board[er][ec] = pieceCaptured
+            if pieceMoved[0] == 'b':
+                self.fullmoveNumber -= 1
             self.whiteToMove = not self.whiteToMove
             #update the kings position
-            if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == 'wK':
+                self.whiteKingLocation = (sr, sc)
+            elif pieceMoved == 'bK':
+                self.blackKingLocation = (sr, sc)
+            self.ply -= 1
+            if self.debugHash:
+                self.checkHash()
+
+    '''
+    Keeps only the last plies moves in moveLog and undoLog, so a game of any length (e.g. in self-play) uses bounded
+    memory. Moves older than that can no longer be undone
+    '''
+    def setHistoryLimit(self, plies):
+        self.moveLog = collections.deque(self.moveLog, maxlen=plies)
+        self.undoLog = collections.deque(self.undoLog, maxlen=plies)
+
+    '''
+    How many times the current position has come up before. Only positions since the last capture or pawn move can be
+    the same, and only every other one has the same side to move, so this compares at most 50 keys from keyHistory
+    however long the game is. Positions from before setPosition aren't known
+    '''
+    def repetitions(self):
+        key = self.zobristKey
+        history = self.keyHistory
+        ply = self.ply
+        count = 0
+        for i in range(ply - 4, ply - min(self.halfmoveClock, ply, HISTORY_SIZE - 1) - 1, -2):
+            if history[i & HISTORY_MASK] == key:
+                count += 1
+        return count
+
+    '''
+    Draw by threefold repetition or by the fifty-move rule. Checkmate on the hundredth half move still wins, so check
+    for that first
+    '''
+    def isDraw(self):
+        return self.halfmoveClock >= 100 or self.repetitions() >= 2
+
+    '''
+    Standard algebraic notation of a packed move in this position, e.g. Nbd7, exd6, O-O or e8=Q+. validCodes are the
+    valid moves of the position, pass them in when converting several moves of the same position
+    '''
+    def toSan(self, code, validCodes=None):
+        if validCodes is None:
+            validCodes = self.getValidMoveCodes()
+        board = self.board
+        start = code & 63
+        end = (code >> 6) & 63
+        piece = board[start >> 3][start & 7]
+        special = code & SPECIAL_MASK
+        if special == CASTLING:
+            san = 'O-O' if end & 7 == 6 else 'O-O-O'
+        else:
+            capture = 'x' if board[end >> 3][end & 7] != '--' or special == EN_PASSANT else ''
+            target = Move.colToFiles[end & 7] + Move.rowsToRanks[end >> 3]
+            if piece[1] == 'p':
+                san = (Move.colToFiles[start & 7] if capture else '') + capture + target
+                if special == PROMOTION:
+                    san += '=' + PROMOTION_PIECES[(code >> 12) & 3]
+            else:
+                # name the start file, rank or both when another piece of the same kind can go to the same square
+                others = [other & 63 for other in validCodes if (other >> 6) & 63 == end and other & 63 != start
+                          and board[(other & 63) >> 3][other & 7] == piece]
+                if not others:
+                    fromSquare = ''
+                elif all(other & 7 != start & 7 for other in others):
+                    fromSquare = Move.colToFiles[start & 7]
+                elif all(other >> 3 != start >> 3 for other in others):
+                    fromSquare = Move.rowsToRanks[start >> 3]
+                else:
+                    fromSquare = Move.colToFiles[start & 7] + Move.rowsToRanks[start >> 3]
+                san = piece[1] + fromSquare + capture + target
+        self.makeMoveCode(code)
+        if self.inCheck():
+            san += '+' if self.getValidMoveCodes() else '#'
+        self.undoMove()
+        return san
+
+    '''
+    Packed move for a move in standard algebraic notation. Check marks and annotations (+ # ! ?) are ignored. Raises
+    ValueError if the move is malformed, illegal or ambiguous in this position
+    '''
+    def parseSan(self, san, validCodes=None):
+        if validCodes is None:
+            validCodes = self.getValidMoveCodes()
+        text = san.rstrip('+#!?')
+        if text in ('O-O', 'O-O-O', '0-0', '0-0-0'):
+            queenside = len(text) == 5
+            for code in validCodes:
+                if code & SPECIAL_MASK == CASTLING and ((code >> 6) & 7 == 2) == queenside:
+                    return code
+            raise ValueError(f'illegal move {san!r} in {self.toFen()}')
+        match = SAN_PATTERN.fullmatch(text)
+        if match is None:
+            raise ValueError(f'bad SAN move {san!r}')
+        kind, fromFile, fromRank, target, promotion = match.groups()
+        kind = kind or 'p'
+        end = Move.ranksToRows[target[1]] * 8 + Move.filesToCol[target[0]]
+        found = None
+        for code in validCodes:
+            start = code & 63
+            if (code >> 6) & 63 != end or self.board[start >> 3][start & 7][1] != kind:
+                continue
+            if fromFile is not None and start & 7 != Move.filesToCol[fromFile]:
+                continue
+            if fromRank is not None and start >> 3 != Move.ranksToRows[fromRank]:
+                continue
+            if code & SPECIAL_MASK == PROMOTION:
+                if promotion != PROMOTION_PIECES[(code >> 12) & 3]:
+                    continue
+            elif promotion is not None:
+                continue
+            if found is not None:
+                raise ValueError(f'ambiguous move {san!r} in {self.toFen()}')
+            found = code
+        if found is None:
+            raise ValueError(f'illegal move {san!r} in {self.toFen()}')
+        return found
+
+    '''
+    Move view of a packed move in the current position
+    '''
+    def moveFromCode(self, code):
+        start = code & 63
+        end = (code >> 6) & 63
+        pieceMoved = self.board[start >> 3][start & 7]
+        if code & SPECIAL_MASK == EN_PASSANT:
+            return Move.fromCode(code, pieceMoved, 'bp' if pieceMoved[0] == 'w' else 'wp')
+        return Move.fromCode(code, pieceMoved, self.board[end >> 3][end & 7])
+
+    '''
+    Recomputes the hash and the evaluation scores from scratch, raises an error if the incremental values have drifted
+    '''
+    def checkHash(self):
+        expected = hashPosition(self.board, self.whiteToMove, self.castlingRights, self.enPassantSquare)
+        if self.zobristKey != expected:
+            raise RuntimeError(f'zobrist key {self.zobristKey:016x} does not match recomputed key {expected:016x} '
+                               f'after {len(self.moveLog)} moves')
+        expected = scoreBoard(self.board)
+        if (self.mgScore, self.egScore, self.phase) != expected:
+            raise RuntimeError(f'scores {(self.mgScore, self.egScore, self.phase)} do not match recomputed scores '
+                               f'{expected} after {len(self.moveLog)} moves')
 
 
     '''
     All moves considering checks
     '''
     def getValidMoves(self):
+        return [self.moveFromCode(code) for code in self.getValidMoveCodes()]
+
+    '''
+    All moves considering checks, as packed moves
+    '''
+    def getValidMoveCodes(self):
+        if self.moveGenerator == 'legal':
+            return self.getLegalMoves()
+        return self.getFilteredMoves()
+
+    '''
+    Valid moves found by making every possible move and checking whether it leaves our king in check
+    '''
+    def getFilteredMoves(self):
         #1. generat eall the possible moves
-        moves = self.getAllPossibleMoves()
+        moves = self.getAllPossibleMoveCodes()
         #2. for each move make the move
         for i in range(len(moves)-1, -1, -1): #when removing from a list, iterate backwards through the list
-            self.makeMove(moves[i])
+            self.makeMoveCode(moves[i])
             #3. generate all the opponents moves
             #4. for of your opponents moves see if they attack your king
             self.whiteToMove = not self.whiteToMove
@@ -91,6 +503,91 @@ class GameState():
         return moves
 
 
+    '''
+    Valid moves found from the checks and pins of the position, without making any moves:
+    - in double check only the king can move
+    - in single check every other piece has to capture the checker or block the check
+    - a pinned piece can only move along the line between its king and the pinning piece
+    - the king can't move onto an attacked square
+    - en passant captures are made and tested, as both pawns leave the rank at once
+    '''
+    def getLegalMoves(self):
+        color = 'w' if self.whiteToMove else 'b'
+        enemy = 'b' if self.whiteToMove else 'w'
+        kr, kc = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = kr * 8 + kc
+        checks, pins = self.getChecksAndPins(kr, kc, color, enemy)
+        moves = []
+        if len(checks) > 1:
+            self.getKingMoves(kr, kc, moves)
+        else:
+            moves = self.getAllPossibleMoveCodes()
+        blockSquares = checks[0] if checks else None
+
+        validMoves = []
+        enPassant = []
+        self.board[kr][kc] = '--' #lift the king so squares behind it along a checking ray count as attacked
+        for code in moves:
+            start = code & 63
+            end = (code >> 6) & 63
+            if code & SPECIAL_MASK == EN_PASSANT:
+                enPassant.append(code) #two pawns leave the capturing rank, which the pins above don't cover
+                continue
+            if start == kingSq:
+                if isSquareAttacked(self.board, end >> 3, end & 7, enemy):
+                    continue
+            else:
+                if start in pins and end not in pins[start]:
+                    continue
+                if blockSquares is not None and end not in blockSquares:
+                    continue
+            validMoves.append(code)
+        self.board[kr][kc] = color + 'K'
+        for code in enPassant: #rare enough to test by making the move
+            self.makeMoveCode(code)
+            self.whiteToMove = not self.whiteToMove
+            if not self.inCheck():
+                validMoves.append(code)
+            self.whiteToMove = not self.whiteToMove
+            self.undoMove()
+        return validMoves
+
+    '''
+    Looks outward from the king on (kr, kc). Returns a list with one set of blocking/capturing squares per checking piece,
+    and a dictionary from each pinned piece's square to the set of squares it may still move to. Squares are row * 8 + col
+    '''
+    def getChecksAndPins(self, kr, kc, color, enemy):
+        checks = []
+        pins = {}
+        for rays, sliders in ((ROOK_RAYS, 'RQ'), (BISHOP_RAYS, 'BQ')):
+            for ray in rays[kr][kc]:
+                possiblePin = None
+                line = []
+                for nr, nc in ray:
+                    line.append(nr * 8 + nc)
+                    piece = self.board[nr][nc]
+                    if piece == '--':
+                        continue
+                    if piece[0] == color:
+                        if possiblePin is not None: #second friendly piece, nothing on this ray matters
+                            break
+                        possiblePin = nr * 8 + nc
+                    else:
+                        if piece[1] in sliders:
+                            if possiblePin is None:
+                                checks.append(set(line))
+                            else:
+                                pins[possiblePin] = set(line)
+                        break
+        for nr, nc in KNIGHT_TARGETS[kr][kc]:
+            if self.board[nr][nc] == enemy + 'N':
+                checks.append({nr * 8 + nc})
+        for nr, nc in PAWN_TARGETS[color][kr][kc]: #enemy pawns check us from the squares our own pawn would attack
+            if self.board[nr][nc] == enemy + 'p':
+                checks.append({nr * 8 + nc})
+        return checks, pins
+
+
     '''
     will determine if the current player is in check
     '''
@@ -105,259 +602,128 @@ class GameState():
     determine if the enemy can attack the square r, c
     '''
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        return False
+        return isSquareAttacked(self.board, r, c, 'b' if self.whiteToMove else 'w')
             
 
     """
     All moves without considering checks
     """
     def getAllPossibleMoves(self):
+        return [self.moveFromCode(code) for code in self.getAllPossibleMoveCodes()]
+
+    def getAllPossibleMoveCodes(self):
         moves = []
         for r in range(len(self.board)): # number of rows
             for c in range(len(self.board[r])): #number of columns in a row
                 turn = self.board[r][c][0]
                 if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
                     piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves) #calls the appropriate move function based on the piece type
+                    self.moveFunctions[piece](self, r, c, moves) #calls the appropriate move function based on the piece type
         return moves
 
     '''
     This will get all the pawn moves located at row, column and add these moves to the list
     '''
-    def getPawnMoves(self, r, c, moves): # Still need to fix index out of bounds, en passant and pawn p
-        if self.whiteToMove: #white pawn moves
-            if self.board[r] == 0:
-                self.board[r][c][1] == "Q"
-            else:
-                if self.board[r-1][c] == '--': #1 square pawn advance
-                    moves.append(Move((r,c), (r-1, c), self.board))
-                    if r == 6 and self.board[r-2][c] == '--':
-                        moves.append(Move((r,c), (r-2, c), self.board))
-                if c-1 >= 0: # makes sure we don't capturing off the board on column '-1', Captures to the left
-                    if self.board[r-1][c-1][0] == 'b': #make sure it is an enemy piece to be captured
-                        moves.append(Move((r, c), (r-1, c-1), self.board))
-                if c+1 <= 7: #captures to the right
-                    if self.board[r-1][c+1][0] == 'b':
-                        moves.append(Move((r, c), (r-1, c+1), self.board))
-    
-        else: #Black pawn moves
-            if self.board[r] == 7:
-                print("test")
-                self.board[r][c][1] == "Q"
-            else:
-                if self.board[r+1][c] == '--':
-                    moves.append(Move((r,c), (r+1, c), self.board))
-                    if r == 1 and self.board[r+2][c] == '--':
-                        moves.append(Move((r,c), (r+2, c), self.board))
-                if c-1 >= 0: 
-                    if self.board[r+1][c-1][0] == 'w': #make sure it is an enemy piece to be captured
-                        moves.append(Move((r, c), (r+1, c-1), self.board))
-                if c+1 <= 7: #captures to the right
-                    if self.board[r+1][c+1][0] == 'w':
-                        moves.append(Move((r, c), (r+1, c+1), self.board))
+    def getPawnMoves(self, r, c, moves):
+        start = r * 8 + c
+        if self.whiteToMove: #white pawns move up the board towards row 0
+            nr, enemy, homeRow = r - 1, 'b', 6
+        else:
+            nr, enemy, homeRow = r + 1, 'w', 1
+        promotes = nr == 0 or nr == 7
+        if self.board[nr][c] == '--': #1 square pawn advance
+            self.addPawnMove(start, nr * 8 + c, promotes, moves)
+            if r == homeRow and self.board[2 * nr - r][c] == '--':
+                moves.append(start | ((2 * nr - r) * 8 + c) << 6)
+        for nc in (c - 1, c + 1): #captures to the left and to the right
+            if 0 <= nc <= 7:
+                end = nr * 8 + nc
+                if self.board[nr][nc][0] == enemy:
+                    self.addPawnMove(start, end, promotes, moves)
+                elif end == self.enPassantSquare:
+                    moves.append(start | end << 6 | EN_PASSANT)
+
+    '''
+    A pawn move onto the last rank is four moves, one per promotion piece. The queen comes first
+    '''
+    def addPawnMove(self, start, end, promotes, moves):
+        if promotes:
+            for i in range(len(PROMOTION_PIECES) - 1, -1, -1):
+                moves.append(start | end << 6 | PROMOTION | i << 12)
+        else:
+            moves.append(start | end << 6)
 
 
+    '''
+    This will get all the bishop moves located at row, column and add these moves to the list
+    '''
     def getBishopMoves(self, r, c, moves):
-        if self.whiteToMove:
-            for i in range(1, 8):
-                if r-i >= 0 and c-i >= 0:
-                    if self.board[r-i][c-i] == '--':
-                        moves.append(Move((r,c), (r-i, c-i), self.board))
-                    if self.board[r-i][c-i][0] == 'b':
-                        moves.append(Move((r,c), (r-i, c-i), self.board))
-                        break
-                if r-i >= 0 and c+i <= 7:
-                    if self.board[r-i][c+i] == '--':
-                        moves.append(Move((r,c), (r-i, c+i), self.board))
-                    if self.board[r-i][c+i][0] == 'b':
-                        moves.append(Move((r,c), (r-i, c+i), self.board))
-                        break
-                if r+i <= 7 and c-i >= 0:
-                    if self.board[r+i][c-i] == '--':
-                        moves.append(Move((r,c), (r+i, c-i), self.board))
-                    if self.board[r+i][c-i][0] == 'b':
-                        moves.append(Move((r,c), (r+i, c-i), self.board))
-                        break
-                if r+i <= 7 and c+i <= 7:
-                    if self.board[r+i][c+i] == '--':
-                        moves.append(Move((r,c), (r+i, c+i), self.board))
-                    if self.board[r+i][c+i][0] == 'b':
-                        moves.append(Move((r,c), (r+i, c+i), self.board))
-                        break
-        else:
-            for i in range(1, 8):
-                if r-i >= 0 and c-i >= 0:
-                    if self.board[r-i][c-i] == '--':
-                        moves.append(Move((r,c), (r-i, c-i), self.board))
-                    if self.board[r-i][c-i][0] == 'w':
-                        moves.append(Move((r,c), (r-i, c-i), self.board))
-                        break
-                if r-i >= 0 and c+i <= 7:
-                    if self.board[r-i][c+i] == '--':
-                        moves.append(Move((r,c), (r-i, c+i), self.board))
-                    if self.board[r-i][c+i][0] == 'w':
-                        moves.append(Move((r,c), (r-i, c+i), self.board))
-                        break
-                if r+i <= 7 and c-i >= 0:
-                    if self.board[r+i][c-i] == '--':
-                        moves.append(Move((r,c), (r+i, c-i), self.board))
-                    if self.board[r+i][c-i][0] == 'w':
-                        moves.append(Move((r,c), (r+i, c-i), self.board))
-                        break
-                if r+i <= 7 and c+i <= 7:
-                    if self.board[r+i][c+i] == '--':
-                        moves.append(Move((r,c), (r+i, c+i), self.board))
-                    if self.board[r+i][c+i][0] == 'w':
-                        moves.append(Move((r,c), (r+i, c+i), self.board))
-                        break
+        self.getSlidingMoves(r, c, BISHOP_RAYS, moves)
 
     '''
     This will get all the rook moves located at row, column and add these moves to the list
     '''
-    def getRookMoves(self, r, c, moves): # need to add castling
-        if self.whiteToMove:
-            for i in range(1, 8):
-                if r-i >= 0:
-                    if self.board[r-i][c] == '--':
-                        moves.append(Move((r,c), (r-i,c), self.board))
-                    if self.board[r-i][c][0] == 'b':
-                        moves.append(Move((r,c), (r-i,c), self.board))
-                        break
-                if r+i <= 7:
-                    if self.board[r+i][c] == '--':
-                        moves.append(Move((r,c), (r+i,c), self.board))
-                    if self.board[r+i][c][0] == 'b':
-                        moves.append(Move((r,c), (r+i,c), self.board))
-                        break
-                if c-i >= 0:
-                    if self.board[r][c-i] == '--':
-                        moves.append(Move((r,c), (r,c-i), self.board))
-                    if self.board[r][c-i][0] == 'b':
-                        moves.append(Move((r,c), (r,c-i), self.board))
-                        break
-                if c+i <= 7:
-                    if self.board[r][c+i] == '--':
-                        moves.append(Move((r,c), (r,c+i), self.board))
-                    if self.board[r][c+i][0] == 'b':
-                        moves.append(Move((r,c), (r,c+i), self.board))
-                        break
-        else:
-            for i in range(1, 8):
-                if r-i >= 0:
-                    if self.board[r-i][c] == '--':
-                        moves.append(Move((r,c), (r-i,c), self.board))
-                    if self.board[r-i][c][0] == 'w':
-                        moves.append(Move((r,c), (r-i,c), self.board))
-                        break
-                if r+i <= 7:
-                    if self.board[r+i][c] == '--':
-                        moves.append(Move((r,c), (r+i,c), self.board))
-                    if self.board[r+i][c][0] == 'w':
-                        moves.append(Move((r,c), (r+i,c), self.board))
-                        break
-                if c-i >= 0:
-                    if self.board[r][c-i] == '--':
-                        moves.append(Move((r,c), (r,c-i), self.board))
-                    if self.board[r][c-i][0] == 'w':
-                        moves.append(Move((r,c), (r,c-i), self.board))
-                        break
-                if c+i <= 7:
-                    if self.board[r][c+i] == '--':
-                        moves.append(Move((r,c), (r,c+i), self.board))
-                    if self.board[r][c+i][0] == 'w':
-                        moves.append(Move((r,c), (r,c+i), self.board))
-                        break
-            
-    
-    def getKnightMoves(self, r, c, moves):
-        knightMoves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2),
-                    (1, -2), (1, 2), (2, -1), (2, 1)]
-        
-        if self.whiteToMove:
-            for move in knightMoves:
-                newRow = r + move[0]
-                newCol = c + move[1]
-                
-                if 0 <= newRow <= 7 and 0 <= newCol <= 7:
-                    if self.board[newRow][newCol] == '--' or self.board[newRow][newCol][0] == 'b':
-                        moves.append(Move((r, c), (newRow, newCol), self.board))
-        else:
-            for move in knightMoves:
-                newRow = r + move[0]
-                newCol = c + move[1]
-                
-                if 0 <= newRow <= 7 and 0 <= newCol <= 7:
-                    if self.board[newRow][newCol] == '--' or self.board[newRow][newCol][0] == 'w':
-                        moves.append(Move((r, c), (newRow, newCol), self.board))
+    def getRookMoves(self, r, c, moves):
+        self.getSlidingMoves(r, c, ROOK_RAYS, moves)
 
+    def getQueenMoves(self, r, c, moves):
+        self.getSlidingMoves(r, c, ROOK_RAYS, moves)
+        self.getSlidingMoves(r, c, BISHOP_RAYS, moves)
 
+    '''
+    Walks each ray leaving (r, c) until it leaves the board, hits one of our pieces, or captures an enemy piece
+    '''
+    def getSlidingMoves(self, r, c, rays, moves):
+        color = 'w' if self.whiteToMove else 'b'
+        start = r * 8 + c
+        for ray in rays[r][c]:
+            for nr, nc in ray:
+                target_piece = self.board[nr][nc]
+                if target_piece == '--':
+                    moves.append(start | (nr * 8 + nc) << 6)
+                else:
+                    if target_piece[0] != color:
+                        moves.append(start | (nr * 8 + nc) << 6)
+                    break
 
-    def getQueenMoves(self, r, c, moves):
-        queenMoves = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+    def getKnightMoves(self, r, c, moves):
+        color = 'w' if self.whiteToMove else 'b'
+        start = r * 8 + c
+        for newRow, newCol in KNIGHT_TARGETS[r][c]:
+            if self.board[newRow][newCol][0] != color:
+                moves.append(start | (newRow * 8 + newCol) << 6)
+
+    def getKingMoves(self, r, c, moves):
+        color = 'w' if self.whiteToMove else 'b'
+        start = r * 8 + c
+        for new_r, new_c in KING_TARGETS[r][c]:
+            if self.board[new_r][new_c][0] != color:
+                moves.append(start | (new_r * 8 + new_c) << 6)
+        self.getCastleMoves(r, c, moves)
+
+    '''
+    Castling moves for the king on (r, c). The king can't castle out of or through check; the square it lands on is
+    checked with the other king moves
+    '''
+    def getCastleMoves(self, r, c, moves):
         if self.whiteToMove:
-            for direction in queenMoves:
-                dr, dc = direction
-                
-                for i in range(1, 8):
-                    new_r = r + i * dr
-                    new_c = c + i * dc
-                    
-                    if 0 <= new_r < 8 and 0 <= new_c < 8:
-                        target_piece = self.board[new_r][new_c]
-                        
-                        if target_piece == '--':
-                            moves.append(Move((r, c), (new_r, new_c), self.board))
-                        elif target_piece[0] == 'b':
-                            moves.append(Move((r, c), (new_r, new_c), self.board))
-                            break
-                    else:
-                        break
+            kingside, queenside, homeRow, rook = WHITE_KINGSIDE, WHITE_QUEENSIDE, 7, 'wR'
         else:
-            for direction in queenMoves:
-                dr, dc = direction
-                
-                for i in range(1, 8):
-                    new_r = r + i * dr
-                    new_c = c + i * dc
-                    
-                    if 0 <= new_r < 8 and 0 <= new_c < 8:
-                        target_piece = self.board[new_r][new_c]
-                        
-                        if target_piece == '--':
-                            moves.append(Move((r, c), (new_r, new_c), self.board))
-                        elif target_piece[0] == 'w':
-                            moves.append(Move((r, c), (new_r, new_c), self.board))
-                            break
-                    else:
-                        break
-                    
-            
-                        
-                        
-    def getKingMoves(self, r, c, moves):
-        directions = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (-1, 1), (1, -1)]
-        board_height = len(self.board)
-        board_width = len(self.board[0])
-        color = 'b' if self.whiteToMove else 'w'
-
-        for direction in directions:
-            dr, dc = direction
-            new_r, new_c = r + dr, c + dc
-            
-            if 0 <= new_r < board_height and 0 <= new_c < board_width:
-                target_piece = self.board[new_r][new_c]
-                
-                if target_piece == '--' or target_piece[0] == color:
-                    moves.append(Move((r, c), (new_r, new_c), self.board))
+            kingside, queenside, homeRow, rook = BLACK_KINGSIDE, BLACK_QUEENSIDE, 0, 'bR'
+        if not self.castlingRights & (kingside | queenside) or r != homeRow or c != 4:
+            return
+        row = self.board[r]
+        start = r * 8 + c
+        if (self.castlingRights & kingside and row[5] == '--' and row[6] == '--' and row[7] == rook
+                and not self.squareUnderAttack(r, 4) and not self.squareUnderAttack(r, 5)):
+            moves.append(start | (start + 2) << 6 | CASTLING)
+        if (self.castlingRights & queenside and row[3] == '--' and row[2] == '--' and row[1] == '--' and row[0] == rook
+                and not self.squareUnderAttack(r, 4) and not self.squareUnderAttack(r, 3)):
+            moves.append(start | (start - 2) << 6 | CASTLING)
 
-            
-            
+    # move function for each piece type. Kept on the class so a GameState doesn't carry a dictionary of bound methods
+    moveFunctions = {'p': getPawnMoves, 'R': getRookMoves, 'N': getKnightMoves,
+                     'B': getBishopMoves, 'K': getKingMoves, 'Q': getQueenMoves}
 
 
 class Move():
@@ -367,15 +733,40 @@ class Move():
     filesToCol = {"a": 0, "b": 1, "c": 2, "d": 3,
                   "e": 4, "f": 5, "g": 6, "h": 7}
     colToFiles = {v: k for k, v in filesToCol.items()}
+    __slots__ = ('moveID', 'pieceMoved', 'pieceCaptured') #moveID is the packed move, see the top of this file
+
     # Constructor
     def __init__(self, startSq, endSq, board):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        self.pieceMoved = board[startSq[0]][startSq[1]]
+        self.pieceCaptured = board[endSq[0]][endSq[1]]
+        self.moveID = startSq[0] * 8 + startSq[1] | (endSq[0] * 8 + endSq[1]) << 6
+
+    '''
+    View of a packed move, for boards that are not stored as an 8x8 list (e.g. BitboardState)
+    '''
+    @classmethod
+    def fromCode(cls, code, pieceMoved, pieceCaptured):
+        move = cls.__new__(cls)
+        move.moveID = code
+        move.pieceMoved = pieceMoved
+        move.pieceCaptured = pieceCaptured
+        return move
+
+    @property
+    def startRow(self):
+        return (self.moveID & 63) >> 3
+
+    @property
+    def startCol(self):
+        return self.moveID & 7
+
+    @property
+    def endRow(self):
+        return (self.moveID >> 9) & 7
+
+    @property
+    def endCol(self):
+        return (self.moveID >> 6) & 7
 
     """
     Overriding the equals
@@ -385,8 +776,23 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
+    '''
+    Long algebraic notation as used by UCI, e.g. e2e4, e1g1 for castling and e7e8q for a promotion
+    '''
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.moveID & SPECIAL_MASK == PROMOTION:
+            notation += PROMOTION_PIECES[(self.moveID >> 12) & 3].lower()
+        return notation
+
+    '''
+    Standard algebraic notation, which depends on the position the move is made in (gs, before the move)
+    '''
+    def getSan(self, gs):
+        return gs.toSan(self.moveID)
 
     def getRankFile(self, r, c):
         return self.colToFiles[c] + self.rowsToRanks[r]
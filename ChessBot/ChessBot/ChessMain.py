@@ -1,21 +1,63 @@
 # This is our main driver file. It will be responsible for handling user input and displaying the current GameState Object.
+# Run it from the project folder with: python -m ChessBot.ChessMain
+import os
+
 import pygame as p
-import ChessEngine
+from ChessBot import ChessEngine
+from ChessBot.Search import Search
+from ChessBot.TranspositionTable import TranspositionTable
 
 WIDTH = HEIGHT = 512 ## 400 is another good option for resolution
 DIMENSIONS = 8 # board is 8x8 squares
 SQ_SIZE = HEIGHT // DIMENSIONS
 MAX_FPS = 15 #For animations later
 IMAGES = {}
+PLAYER_ONE_HUMAN = True # white: True if a human is playing, False if the engine plays
+PLAYER_TWO_HUMAN = True # black
+ENGINE_TIME = 1.0 # seconds the engine thinks per move
+
+PIECES = ['wp', 'bp', 'wK', 'wQ', 'wR', 'wB', 'wN', 'bK', 'bQ', 'bR', 'bB', 'bN']
+PICTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Pictures") # next to the package, not the CWD
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "ChessBot")
+
+'''
+Initialize a global dictionary of images. This will be called once in the main, after the display is set up.
+Each image is a piece of one sprite atlas that is already scaled to sqSize and converted to the display's format
+'''
+
+def loadImages(sqSize=SQ_SIZE):
+    atlas = loadAtlas(sqSize).convert_alpha() # same pixel format as the screen, so blits don't convert every frame
+    for i, piece in enumerate(PIECES):
+        IMAGES[piece] = atlas.subsurface(p.Rect((i*sqSize, 0), (sqSize, sqSize)))
 
 '''
-Initialize a global dictionary of images. This will be called once in the main
+All twelve pieces side by side, scaled to sqSize. The first launch at a square size decodes and scales the PNGs and saves
+the result as raw RGBA in CACHE_DIR; later launches read that file back without any decoding or scaling.
+The cache is rebuilt when a picture is newer than it
 '''
+def loadAtlas(sqSize):
+    size = (sqSize * len(PIECES), sqSize)
+    cachePath = os.path.join(CACHE_DIR, f"atlas_{sqSize}.rgba")
+    pictures = [os.path.join(PICTURES_DIR, piece + ".png") for piece in PIECES]
+    try:
+        if os.path.getmtime(cachePath) >= max(os.path.getmtime(picture) for picture in pictures):
+            with open(cachePath, "rb") as f:
+                data = f.read()
+            if len(data) == size[0] * size[1] * 4:
+                return p.image.frombytes(data, size, "RGBA")
+    except OSError:
+        pass # no cache yet
 
-def loadImages():
-    pieces = ['wp', 'bp', 'wK', 'wQ', 'wR', 'wB', 'wN', 'bK', 'bQ', 'bR', 'bB', 'bN']
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("Pictures/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+    atlas = p.Surface(size, p.SRCALPHA)
+    for i, picture in enumerate(pictures):
+        atlas.blit(p.transform.scale(p.image.load(picture), (sqSize, sqSize)), (i*sqSize, 0))
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cachePath, "wb") as f:
+            f.write(p.image.tobytes(atlas, "RGBA"))
+    except OSError:
+        pass # read-only home directory: still works, just without the cache
+    return atlas
 
 
 #The main driver for our code. THis will handle user input and updating the graphics
@@ -26,19 +68,34 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameState() # Calls the constructor and creates an instance of GameState with the three variables
-    validMoves = gs.getValidMoves()
+    moveCache = {} # zobristKey -> valid moves, so going back and forth with undo doesn't regenerate them
+    validMoves = getValidMoves(gs, moveCache)
+    tt = TranspositionTable() # kept for the whole game so the engine reuses earlier searches
     moveMade = False #Flag varibale for when a move is made
 
     loadImages() #only do this once before the while loop
     running = True
     sqSelected = () # no square is selected intially, keep track of the last click of the user, contains the row and column
     playerClicks = [] #keeps track of the player clicks (two tuples: (6, 4), (4, 4))
+    drawGameState(screen, gs)
+    p.display.flip()
+    drawnBoard = [row[:] for row in gs.board] # what is on the screen, so only squares that changed get repainted
 
     while running:
-        for e in p.event.get():
+        humanTurn = (gs.whiteToMove and PLAYER_ONE_HUMAN) or (not gs.whiteToMove and PLAYER_TWO_HUMAN)
+        engineTurn = not humanTurn and len(validMoves) > 0 and not gs.isDraw()
+        if not engineTurn:
+            events = [p.event.wait()] + p.event.get() # nothing changes until the user does something (or the game is over), so sleep until then
+        else:
+            events = p.event.get()
+        for e in events:
             if e.type == p.QUIT:
                 running = False
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.VIDEOEXPOSE: # the window was covered or restored, repaint all of it
+                drawGameState(screen, gs)
+                p.display.flip()
+                drawnBoard = [row[:] for row in gs.board]
+            elif e.type == p.MOUSEBUTTONDOWN and humanTurn:
                 location = p.mouse.get_pos() # gets x and y location of the mouse
                 col = location[0]//SQ_SIZE
                 row = location[1]//SQ_SIZE
@@ -53,11 +110,13 @@ def main():
                 if len(playerClicks) == 2:
                     move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
                     print(move.getChessNotation())
-                    if move in validMoves:
-                        moveMade = True
-                        gs.makeMove(move)
-                        sqSelected = () #resets user clicks
-                        playerClicks = []
+                    for validMove in validMoves:
+                        if move.moveID == validMove.moveID & 0xFFF: #same squares, promotions come queen first
+                            moveMade = True
+                            gs.makeMove(validMove) # the generated move, which carries any special move flags
+                            sqSelected = () #resets user clicks
+                            playerClicks = []
+                            break
                     else:
                         playerClicks = [sqSelected]
                         
@@ -67,12 +126,34 @@ def main():
                     gs.undoMove()
                     moveMade = True
 
+        #engine move
+        if engineTurn and running:
+            gs.makeMove(Search(gs, tt).search(timeLimit=ENGINE_TIME))
+            moveMade = True
+
         if moveMade:
-            validMoves = gs.getValidMoves() # only gets valid moves when a move is actually made
+            validMoves = getValidMoves(gs, moveCache) # only gets valid moves when a move is actually made
+            moveMade = False
+            if not validMoves:
+                print('checkmate' if gs.inCheck() else 'stalemate')
+            elif gs.isDraw():
+                print('draw by repetition' if gs.halfmoveClock < 100 else 'draw by the fifty-move rule')
 
-        drawGameState(screen, gs)
+        dirtyRects = drawChangedSquares(screen, gs.board, drawnBoard)
+        if dirtyRects:
+            p.display.update(dirtyRects)
         clock.tick(MAX_FPS)
-        p.display.flip()
+
+
+"""
+Valid moves of the current position, from the cache if this position has been seen before
+"""
+def getValidMoves(gs, moveCache):
+    if gs.zobristKey not in moveCache:
+        if len(moveCache) > 4096: # long games: start over rather than keep every position
+            moveCache.clear()
+        moveCache[gs.zobristKey] = gs.getValidMoves()
+    return moveCache[gs.zobristKey]
             
 
 """
@@ -86,11 +167,9 @@ def drawGameState(screen, gs):
 Draws the squares on the board. Top left square is always White for either perspective
 """
 def drawBoard(screen):
-    colors = [p.Color("white"), p.Color("dark gray")]
     for r in range(DIMENSIONS):
         for c in range(DIMENSIONS):
-            color = colors[((r+c) % 2)]
-            p.draw.rect(screen, color, p.Rect((c*SQ_SIZE, r*SQ_SIZE), (SQ_SIZE, SQ_SIZE)))
+            drawSquare(screen, r, c)
 
 """
 Draws the pieces on the board using the current GameState.board
@@ -102,6 +181,28 @@ def drawPieces(screen, board):
             if piece != "--":
                 screen.blit(IMAGES[piece], p.Rect((c*SQ_SIZE, r*SQ_SIZE), (SQ_SIZE, SQ_SIZE)))
 
+def drawSquare(screen, r, c):
+    colors = [p.Color("white"), p.Color("dark gray")]
+    p.draw.rect(screen, colors[((r+c) % 2)], p.Rect((c*SQ_SIZE, r*SQ_SIZE), (SQ_SIZE, SQ_SIZE)))
+
+"""
+Repaints only the squares whose piece differs from drawnBoard (the board as last drawn) and brings drawnBoard up to date.
+Returns the rectangles that changed, for display.update
+"""
+def drawChangedSquares(screen, board, drawnBoard):
+    dirtyRects = []
+    for r in range(DIMENSIONS):
+        for c in range(DIMENSIONS):
+            piece = board[r][c]
+            if piece != drawnBoard[r][c]:
+                drawSquare(screen, r, c)
+                rect = p.Rect((c*SQ_SIZE, r*SQ_SIZE), (SQ_SIZE, SQ_SIZE))
+                if piece != "--":
+                    screen.blit(IMAGES[piece], rect)
+                drawnBoard[r][c] = piece
+                dirtyRects.append(rect)
+    return dirtyRects
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,134 @@
+# Material plus piece-square table evaluation, tapered between a middlegame and an endgame score.
+# GameState keeps the two scores and the game phase up to date in makeMove/undoMove by adding and subtracting table
+# entries for the squares that changed, so evaluating a position never has to look at the whole board.
+#
+# The tables are the "Simplified Evaluation Function" tables from the Chess Programming Wiki, with separate endgame
+# tables for the king (walk to the centre) and pawns (push). They are written from white's side with row 0 = rank 8,
+# the same as GameState.board; black uses them mirrored and negated, so every score is from white's point of view.
+
+MG_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+EG_VALUES = {'p': 120, 'N': 300, 'B': 320, 'R': 520, 'Q': 920, 'K': 0}
+PHASE_WEIGHTS = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24 #all the pieces of the starting position
+
+PAWN_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [10, 10, 20, 30, 30, 20, 10, 10],
+    [5, 5, 10, 25, 25, 10, 5, 5],
+    [0, 0, 0, 20, 20, 0, 0, 0],
+    [5, -5, -10, 0, 0, -10, -5, 5],
+    [5, 10, 10, -20, -20, 10, 10, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+]
+PAWN_ENDGAME_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [80, 80, 80, 80, 80, 80, 80, 80],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [30, 30, 30, 30, 30, 30, 30, 30],
+    [20, 20, 20, 20, 20, 20, 20, 20],
+    [10, 10, 10, 10, 10, 10, 10, 10],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+]
+KNIGHT_TABLE = [
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+    [-40, -20, 0, 0, 0, 0, -20, -40],
+    [-30, 0, 10, 15, 15, 10, 0, -30],
+    [-30, 5, 15, 20, 20, 15, 5, -30],
+    [-30, 0, 15, 20, 20, 15, 0, -30],
+    [-30, 5, 10, 15, 15, 10, 5, -30],
+    [-40, -20, 0, 5, 5, 0, -20, -40],
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+]
+BISHOP_TABLE = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 10, 10, 5, 0, -10],
+    [-10, 5, 5, 10, 10, 5, 5, -10],
+    [-10, 0, 10, 10, 10, 10, 0, -10],
+    [-10, 10, 10, 10, 10, 10, 10, -10],
+    [-10, 5, 0, 0, 0, 0, 5, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+]
+ROOK_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [5, 10, 10, 10, 10, 10, 10, 5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [0, 0, 0, 5, 5, 0, 0, 0],
+]
+QUEEN_TABLE = [
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 5, 5, 5, 0, -10],
+    [-5, 0, 5, 5, 5, 5, 0, -5],
+    [0, 0, 5, 5, 5, 5, 0, -5],
+    [-10, 5, 5, 5, 5, 5, 0, -10],
+    [-10, 0, 5, 0, 0, 0, 0, -10],
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+]
+KING_TABLE = [
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-20, -30, -30, -40, -40, -30, -30, -20],
+    [-10, -20, -20, -20, -20, -20, -20, -10],
+    [20, 20, 0, 0, 0, 0, 20, 20],
+    [20, 30, 10, 0, 0, 10, 30, 20],
+]
+KING_ENDGAME_TABLE = [
+    [-50, -40, -30, -20, -20, -30, -40, -50],
+    [-30, -20, -10, 0, 0, -10, -20, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -30, 0, 0, 0, 0, -30, -30],
+    [-50, -30, -30, -30, -30, -30, -30, -50],
+]
+
+MG_TABLES = {'p': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE, 'K': KING_TABLE}
+EG_TABLES = {'p': PAWN_ENDGAME_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE,
+             'K': KING_ENDGAME_TABLE}
+
+
+def _pieceSquareScores(values, tables):
+    scores = {}
+    for kind, table in tables.items():
+        scores['w' + kind] = [[values[kind] + table[r][c] for c in range(8)] for r in range(8)]
+        scores['b' + kind] = [[-(values[kind] + table[7 - r][c]) for c in range(8)] for r in range(8)]
+    return scores
+
+# MG_SCORES[piece][row][col]: material plus table entry, negative for black. Same for EG_SCORES
+MG_SCORES = _pieceSquareScores(MG_VALUES, MG_TABLES)
+EG_SCORES = _pieceSquareScores(EG_VALUES, EG_TABLES)
+PHASE = {color + kind: weight for kind, weight in PHASE_WEIGHTS.items() for color in 'wb'}
+
+
+'''
+Middlegame score, endgame score and phase of a board, from scratch. GameState only does this when a position is set up
+'''
+def scoreBoard(board):
+    mg = eg = phase = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != '--':
+                mg += MG_SCORES[piece][r][c]
+                eg += EG_SCORES[piece][r][c]
+                phase += PHASE[piece]
+    return mg, eg, phase
+
+
+'''
+Tapered score of the position from the side to move's point of view, from the scores GameState keeps up to date
+'''
+def evaluate(gs):
+    phase = min(gs.phase, MAX_PHASE) #promotions can push the phase past a full board
+    score = (gs.mgScore * phase + gs.egScore * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if gs.whiteToMove else -score
@@ -0,0 +1,205 @@
+# Opt-in profiling of the engine's hot paths. enable() swaps timing wrappers in for the move generators of GameState and
+# BitboardState, the search phases of Search, the evaluation and the transposition table, and disable() puts the
+# original functions back. Nothing is wrapped until enable() is called, so normal runs pay nothing for it.
+#
+#   with profiling() as profiler:
+#       perft(gs, 4)
+#   profiler.dumpJson('profile.json')     # calls, total and self time per function, plus counters
+#   profiler.dumpFolded('profile.folded') # "a;b;c microseconds" lines for flamegraph.pl or speedscope
+#
+# The wrappers time every call, which slows the engine down several times over: compare profiles with each other, not
+# with unprofiled runs. Calls are tracked on one stack, so profile one thread at a time.
+
+import collections
+import contextlib
+import json
+import time
+
+from . import ChessEngine, Search, Bitboard, TranspositionTable
+
+# (owner, attribute) of every function that gets timed. Move construction is only counted
+TIMED = [
+    (ChessEngine.GameState, 'getValidMoveCodes'),
+    (ChessEngine.GameState, 'getLegalMoves'),
+    (ChessEngine.GameState, 'getFilteredMoves'),
+    (ChessEngine.GameState, 'getChecksAndPins'),
+    (ChessEngine.GameState, 'getAllPossibleMoveCodes'),
+    (ChessEngine.GameState, 'getPawnMoves'),
+    (ChessEngine.GameState, 'getKnightMoves'),
+    (ChessEngine.GameState, 'getBishopMoves'),
+    (ChessEngine.GameState, 'getRookMoves'),
+    (ChessEngine.GameState, 'getQueenMoves'),
+    (ChessEngine.GameState, 'getKingMoves'),
+    (ChessEngine.GameState, 'getCastleMoves'),
+    (ChessEngine.GameState, 'squareUnderAttack'),
+    (ChessEngine.GameState, 'inCheck'),
+    (ChessEngine.GameState, 'makeMoveCode'),
+    (ChessEngine.GameState, 'undoMove'),
+    (ChessEngine, 'isSquareAttacked'),
+    (Bitboard.BitboardState, 'getValidMoveCodes'),
+    (Bitboard.BitboardState, 'getAllPossibleMoveCodes'),
+    (Bitboard.BitboardState, 'getPawnMoves'),
+    (Bitboard.BitboardState, 'getCastleMoves'),
+    (Bitboard.BitboardState, 'isAttacked'),
+    (Bitboard.BitboardState, 'makeMoveCode'),
+    (Bitboard.BitboardState, 'undoMove'),
+    (Search.Search, 'probeRoot'),
+    (Search.Search, 'negamax'),
+    (Search.Search, 'quiescence'),
+    (Search.Search, 'orderMoves'),
+    (Search, 'evaluate'),
+    (TranspositionTable.TranspositionTable, 'probe'),
+    (TranspositionTable.TranspositionTable, 'store'),
+]
+COUNTED = [
+    (ChessEngine.Move, '__init__'),
+    (ChessEngine.Move, 'fromCode'),
+]
+
+_profiler = None
+_originals = [] #(owner, attribute, original) of everything replaced, put back by disable()
+
+
+class Profiler():
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.selfTime = collections.Counter() #nanoseconds spent in the function itself, not in timed functions it calls
+        self.totalTime = collections.Counter() #nanoseconds from the outermost call in, so recursion isn't counted twice
+        self.paths = collections.Counter() #"a;b;c" call path -> self nanoseconds, for flamegraphs
+        self.counters = collections.Counter()
+        self.stack = [] #[name, path, start, nanoseconds in timed children] per active call
+        self.active = collections.Counter() #calls of each name currently on the stack
+
+    def reset(self):
+        self.__init__()
+
+    def enter(self, name):
+        path = self.stack[-1][1] + ';' + name if self.stack else name
+        self.active[name] += 1
+        self.stack.append([name, path, time.perf_counter_ns(), 0])
+
+    def exit(self):
+        name, path, start, children = self.stack.pop()
+        elapsed = time.perf_counter_ns() - start
+        own = elapsed - children
+        if self.stack:
+            self.stack[-1][3] += elapsed
+        self.calls[name] += 1
+        self.selfTime[name] += own
+        self.paths[path] += own
+        self.active[name] -= 1
+        if not self.active[name]:
+            self.totalTime[name] += elapsed
+
+    def timed(self, name, func):
+        enter = self.enter
+        exit = self.exit
+
+        def wrapper(*args, **kwargs):
+            enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                exit()
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def counted(self, name, func):
+        counters = self.counters
+
+        def wrapper(*args, **kwargs):
+            counters[name] += 1
+            return func(*args, **kwargs)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    '''
+    Everything measured so far as a dictionary that can be written as JSON. Times are in milliseconds
+    '''
+    def report(self):
+        functions = {}
+        for name, calls in self.calls.most_common():
+            functions[name] = {'calls': calls, 'totalMs': self.totalTime[name] / 1e6, 'selfMs': self.selfTime[name] / 1e6,
+                               'selfUsPerCall': self.selfTime[name] / calls / 1e3}
+        return {'functions': functions, 'counters': dict(self.counters)}
+
+    def dumpJson(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    '''
+    Folded stacks, one "outer;inner;innermost microseconds" line per call path, the input format of flamegraph.pl
+    and speedscope
+    '''
+    def dumpFolded(self, path):
+        with open(path, 'w') as f:
+            for stack, nanoseconds in sorted(self.paths.items()):
+                if nanoseconds >= 1000:
+                    f.write(f'{stack} {nanoseconds // 1000}\n')
+
+    '''
+    The report as a table, slowest functions (by self time) first
+    '''
+    def summary(self):
+        report = self.report()
+        lines = [f"{'function':<40} {'calls':>10} {'total ms':>10} {'self ms':>10} {'self us/call':>12}"]
+        for name, stats in sorted(report['functions'].items(), key=lambda item: -item[1]['selfMs']):
+            lines.append(f"{name:<40} {stats['calls']:>10} {stats['totalMs']:>10.1f} {stats['selfMs']:>10.1f} "
+                         f"{stats['selfUsPerCall']:>12.2f}")
+        for name, count in report['counters'].items():
+            lines.append(f'{name:<40} {count:>10}')
+        return '\n'.join(lines)
+
+
+def _name(owner, attribute):
+    prefix = owner.__name__.rsplit('.', 1)[-1]
+    return f'{prefix}.{attribute}'
+
+def _replace(owner, attribute, wrap):
+    original = owner.__dict__[attribute] if isinstance(owner, type) else getattr(owner, attribute)
+    _originals.append((owner, attribute, original))
+    if isinstance(original, classmethod):
+        setattr(owner, attribute, classmethod(wrap(original.__func__)))
+    else:
+        setattr(owner, attribute, wrap(original))
+
+'''
+Installs the wrappers and returns the Profiler that collects their numbers. Calling it again while enabled returns the
+same Profiler
+'''
+def enable():
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    profiler = Profiler()
+    for owner, attribute in TIMED:
+        _replace(owner, attribute, lambda func, name=_name(owner, attribute): profiler.timed(name, func))
+    for owner, attribute in COUNTED:
+        _replace(owner, attribute, lambda func, name=_name(owner, attribute): profiler.counted(name, func))
+    # getAllPossibleMoveCodes calls the piece generators through this dictionary, not through the class attributes
+    GameState = ChessEngine.GameState
+    _originals.append((GameState, 'moveFunctions', GameState.moveFunctions))
+    GameState.moveFunctions = {piece: GameState.__dict__[func.__name__] for piece, func in GameState.moveFunctions.items()}
+    _profiler = profiler
+    return profiler
+
+'''
+Puts every original function back. The Profiler keeps its numbers
+'''
+def disable():
+    global _profiler
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+    _profiler = None
+
+def isEnabled():
+    return _profiler is not None
+
+@contextlib.contextmanager
+def profiling():
+    profiler = enable()
+    try:
+        yield profiler
+    finally:
+        disable()
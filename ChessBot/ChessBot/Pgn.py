@@ -0,0 +1,381 @@
+# Streaming PGN reading and writing. readGames parses a PGN file one game at a time, so memory stays the same however big
+# the file is, and PgnGame.replay plays each game through a GameState, resolving the SAN moves against the valid moves.
+# A file can be split into byte ranges (shardOffsets) that are read independently, one per core:
+#
+#   for game in readGames('games.pgn'):
+#       for gs, code in game.replay():
+#           ...
+#
+#   python -m ChessBot.Pgn games.pgn --workers 8                 (replay and validate every game)
+#   python -m ChessBot.Pgn games.pgn --epd positions.epd         (and write every position as EPD)
+#   python -m ChessBot.Pgn --check                               (SAN and sharding regression check, see runChecks)
+#
+# Games are split at their "[Event" tag, which the PGN standard puts first in every game.
+
+import argparse
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+
+from .Analysis import runJobs
+from .ChessEngine import GameState
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+SEVEN_TAGS = ['Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result']
+RESULTS = {'1-0', '0-1', '1/2-1/2', '*'}
+HEADER_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_PATTERN = re.compile(r'[{}();]|[^\s{}();]+')
+MOVE_NUMBER_PATTERN = re.compile(r'\d+\.+')
+
+# Games for runChecks, in the SAN toSan writes. Between them they have castling on both sides, en passant for both
+# colours, promotion and underpromotion, check and mate marks, a game that starts with black to move, and the comments,
+# variations and NAGs readGames has to skip
+CHECK_PGN = '''[Event "castling and en passant"]
+[Result "*"]
+
+1. e4 d5 2. e5 f5 3. exf6 {en passant} Nxf6 4. Nf3 Bg4 (4... Nc6 5. d4) 5. Be2 Nc6
+6. O-O Qd7 $1 7. d4 O-O-O 8. c4 dxc4 9. d5 e5 10. dxe6 Qxe6 11. Nc3 Nb4 12. a3 Nd3
+13. Bxd3 cxd3 14. Qxd3 Bxf3 15. Qxf3 Rd2 *
+
+[Event "promotion"]
+[Result "1/2-1/2"]
+[SetUp "1"]
+[FEN "1r6/P5k1/8/8/8/8/6Kp/8 w - - 0 1"]
+
+1. axb8=N h1=Q+ 2. Kxh1 Kf6 1/2-1/2
+
+[Event "black first"]
+[Result "*"]
+[SetUp "1"]
+[FEN "4k3/8/8/8/2pP4/8/8/4K3 b - d3 0 1"]
+
+1... cxd3 ; en passant by black
+2. Kd2 Kd7 *
+
+[Event "mate"]
+[Result "1-0"]
+
+1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0
+
+'''
+
+
+class PgnGame():
+    def __init__(self, headers, moves, result, offset):
+        self.headers = headers #tag name -> value
+        self.moves = moves #SAN strings of the main line, comments and variations left out
+        self.result = result
+        self.offset = offset #byte offset of the game in its file
+
+    @property
+    def fen(self):
+        return self.headers.get('FEN', START_FEN)
+
+    '''
+    Plays the game through a new GameState and yields (gs, packed move) before each move is made, so gs is the position
+    the move is played in. Raises ValueError at the first move that isn't legal
+    '''
+    def replay(self):
+        gs = GameState.fromFen(self.fen)
+        for san in self.moves:
+            code = gs.parseSan(san)
+            yield gs, code
+            gs.makeMoveCode(code)
+
+    '''
+    The GameState after the last move
+    '''
+    def finalPosition(self):
+        gs = GameState.fromFen(self.fen)
+        for san in self.moves:
+            gs.makeMoveCode(gs.parseSan(san))
+        return gs
+
+
+'''
+Yields the games of a PGN file as PgnGame objects, reading one line at a time. With start/end only the games whose
+"[Event" tag starts in that byte range are read, so a file can be shared out in pieces that don't overlap
+'''
+def readGames(path, start=0, end=None):
+    with open(path, 'rb') as f:
+        pos = 0
+        if start > 0:
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline()) #the rest of the line start is in belongs to the range before
+            for line in f: #skip to the next game
+                if line.startswith(b'[Event '):
+                    break
+                pos += len(line)
+            else:
+                return
+            f.seek(pos)
+        headers = {}
+        moves = []
+        offset = None
+        inComment = False #inside {...}, which can go over several lines
+        variationDepth = 0 #inside (...), variations can be nested
+        for line in f:
+            lineStart = pos
+            pos += len(line)
+            text = line.decode('utf-8', 'replace')
+            stripped = text.strip()
+            if not inComment and stripped.startswith('['):
+                if moves: #a header after moves is the next game, whose movetext had no result
+                    yield PgnGame(headers, moves, '*', offset)
+                    headers, moves, offset = {}, [], None
+                if offset is None:
+                    if end is not None and lineStart >= end:
+                        return
+                    offset = lineStart
+                match = HEADER_PATTERN.match(stripped)
+                if match:
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+            if not stripped or stripped.startswith('%'):
+                continue
+            if offset is None:
+                if end is not None and lineStart >= end:
+                    return
+                offset = lineStart
+            for token in TOKEN_PATTERN.findall(text):
+                if inComment:
+                    inComment = token != '}'
+                elif token == '{':
+                    inComment = True
+                elif token == ';':
+                    break #comment to the end of the line
+                elif token == '(':
+                    variationDepth += 1
+                elif token == ')':
+                    variationDepth -= 1
+                elif variationDepth > 0 or token.startswith('$'):
+                    continue
+                elif token in RESULTS:
+                    yield PgnGame(headers, moves, token, offset)
+                    headers, moves, offset = {}, [], None
+                elif not token.isdigit():
+                    token = MOVE_NUMBER_PATTERN.sub('', token, count=1) #"12." or "12...", maybe run into the move
+                    if token:
+                        moves.append(token)
+        if moves or headers:
+            yield PgnGame(headers, moves, headers.get('Result', '*'), offset)
+
+
+'''
+Splits a file into shards byte ranges of about the same size, as (start, end) pairs for readGames
+'''
+def shardOffsets(path, shards):
+    size = os.path.getsize(path)
+    return [(size * i // shards, size * (i + 1) // shards) for i in range(shards)]
+
+
+'''
+Result of a game from its final position: '1-0', '0-1', '1/2-1/2' or '*' if it isn't over
+'''
+def gameResult(gs):
+    if not gs.getValidMoveCodes():
+        return ('0-1' if gs.whiteToMove else '1-0') if gs.inCheck() else '1/2-1/2'
+    if gs.isDraw():
+        return '1/2-1/2'
+    return '*'
+
+'''
+Writes the game played in gs (every move in its moveLog) as PGN. headers are added to the seven required tags, and
+the result is worked out from the final position unless it is given
+'''
+def writeGame(f, gs, headers=None, result=None):
+    codes = list(gs.moveLog)
+    if len(codes) != gs.ply:
+        raise ValueError('the move log has been trimmed (setHistoryLimit), the game can no longer be written out')
+    for code in codes: #back to the first position, then forward again to get each move's SAN
+        gs.undoMove()
+    startFen = gs.toFen()
+    firstMove = gs.fullmoveNumber
+    blackFirst = not gs.whiteToMove
+    sans = []
+    for code in codes:
+        sans.append(gs.toSan(code))
+        gs.makeMoveCode(code)
+    result = result or gameResult(gs)
+
+    tags = {tag: '?' for tag in SEVEN_TAGS}
+    tags.update(headers or {})
+    tags['Result'] = result
+    if startFen != START_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = startFen
+    for tag, value in tags.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        f.write(f'[{tag} "{value}"]\n')
+    f.write('\n')
+
+    tokens = []
+    for i, san in enumerate(sans):
+        ply = i + blackFirst
+        if ply % 2 == 0:
+            tokens.append(f'{firstMove + ply // 2}.')
+        elif i == 0:
+            tokens.append(f'{firstMove}...')
+        tokens.append(san)
+    tokens.append(result)
+    line = ''
+    for token in tokens: #lines of at most 79 characters, as the standard asks
+        if line and len(line) + 1 + len(token) > 79:
+            f.write(line + '\n')
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    f.write(line + '\n\n')
+
+'''
+Writes the position of gs as one EPD line, with optional operations, e.g. {'bm': 'e4', 'id': '"start"'}
+'''
+def writeEpd(f, gs, operations=None):
+    fields = ' '.join(gs.toFen().split()[:4])
+    ops = ''.join(f' {opcode} {operand};' for opcode, operand in (operations or {}).items())
+    f.write(fields + ops + '\n')
+
+
+######## REGRESSION CHECK
+
+'''
+Checks SAN and sharding on CHECK_PGN and reports each check like perft's suite. Returns True if all of them passed:
+    san     every move of the games is written back by toSan exactly as in the file, and every valid move of every
+            position comes back from parseSan(toSan(move)) unchanged
+    write   writeGame of each final position reads back as the same moves, start position and result
+    shards  with the games repeated in one file, every split into shards reads each game exactly once, in order
+'''
+def runChecks():
+    passed = True
+
+    def report(ok, name, detail):
+        nonlocal passed
+        passed = passed and ok
+        print(f'{"ok  " if ok else "FAIL"} {name}: {detail}')
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'check.pgn')
+        with open(path, 'w') as f:
+            f.write(CHECK_PGN)
+        games = list(readGames(path))
+        moves = positions = 0
+        errors = []
+        for game in games:
+            try:
+                for (gs, code), san in zip(game.replay(), game.moves):
+                    moves += 1
+                    if gs.toSan(code) != san:
+                        errors.append(f'{san} written as {gs.toSan(code)}')
+                    validCodes = gs.getValidMoveCodes()
+                    for valid in validCodes:
+                        positions += 1
+                        if gs.parseSan(gs.toSan(valid, validCodes), validCodes) != valid:
+                            errors.append(f'{gs.toSan(valid, validCodes)} in {gs.toFen()} read back as another move')
+            except ValueError as e:
+                errors.append(str(e))
+        report(not errors and len(games) == 4, 'san', errors[0] if errors else f'{len(games)} games, {moves} moves, '
+                                                                              f'{positions} moves round-tripped')
+
+        errors = []
+        for game in games:
+            out = io.StringIO()
+            writeGame(out, game.finalPosition(), {'Event': game.headers.get('Event')}, game.result)
+            copyPath = os.path.join(folder, 'copy.pgn')
+            with open(copyPath, 'w') as f:
+                f.write(out.getvalue())
+            copies = list(readGames(copyPath))
+            same = len(copies) == 1 and (copies[0].moves, copies[0].fen, copies[0].result) == (game.moves, game.fen,
+                                                                                               game.result)
+            if not same:
+                errors.append(game.headers.get('Event'))
+        report(not errors, 'write',
+               f'{errors[0]} changed when written out' if errors else f'{len(games)} games written and read back')
+
+        with open(path, 'w') as f:
+            for i in range(25):
+                f.write(CHECK_PGN)
+        offsets = [game.offset for game in readGames(path)]
+        size = os.path.getsize(path)
+        errors = []
+        for shards in (1, 2, 3, 7, 50, len(offsets), size // 3):
+            found = [game.offset for start, end in shardOffsets(path, shards) for game in readGames(path, start, end)]
+            if found != offsets:
+                errors.append(f'{shards} shards read {len(found)} games')
+        report(not errors and len(offsets) == 100, 'shards',
+               errors[0] if errors else f'{len(offsets)} games read once each in 1 to {size // 3} shards')
+    return passed
+
+
+######## SHARD JOBS (run in worker processes by main)
+
+'''
+Replays every game of one shard. Returns counts and the first error of every game that failed to replay
+'''
+def validateShard(path, start, end, epdPath=None):
+    begin = time.perf_counter()
+    games = plies = 0
+    errors = []
+    out = open(epdPath, 'w') if epdPath else None
+    try:
+        for game in readGames(path, start, end):
+            games += 1
+            try:
+                for gs, code in game.replay():
+                    if out is not None:
+                        writeEpd(out, gs, {'hmvc': gs.halfmoveClock, 'fmvn': gs.fullmoveNumber})
+                    plies += 1
+            except ValueError as e:
+                errors.append((game.offset, str(e)))
+    finally:
+        if out is not None:
+            out.close()
+    return {'start': start, 'games': games, 'plies': plies, 'errors': errors, 'epd': epdPath,
+            'time': time.perf_counter() - begin}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ChessBot.Pgn', description='Replay and validate PGN files')
+    parser.add_argument('pgn', nargs='?', help='PGN file')
+    parser.add_argument('--epd', default=None, help='also write every position to this EPD file')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    parser.add_argument('--shards', type=int, default=None, help='pieces to split the file into, default 4 per worker')
+    parser.add_argument('--check', action='store_true', help='run the SAN and sharding regression check instead')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        return 0 if runChecks() else 1
+    if args.pgn is None:
+        parser.error('a PGN file is needed unless --check is given')
+
+    workers = args.workers or os.cpu_count() or 1
+    shards = shardOffsets(args.pgn, args.shards or workers * 4)
+    jobs = ((args.pgn, start, end, f'{args.epd}.{i:04d}' if args.epd else None) for i, (start, end) in enumerate(shards))
+    begin = time.perf_counter()
+    games = plies = failed = 0
+    out = open(args.epd, 'w') if args.epd else None
+    try:
+        for result in runJobs(validateShard, jobs, workers): #in file order, so the EPD parts are joined in order
+            games += result['games']
+            plies += result['plies']
+            failed += len(result['errors'])
+            for offset, message in result['errors']:
+                print(f'game at byte {offset}: {message}')
+            if out is not None:
+                with open(result['epd']) as part:
+                    for line in part:
+                        out.write(line)
+                os.remove(result['epd'])
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - begin
+    print(f'{games} games, {plies} moves, {failed} failed in {elapsed:.2f}s '
+          f'({plies / elapsed if elapsed > 0 else 0:,.0f} moves/sec)')
+    return 0 if not failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
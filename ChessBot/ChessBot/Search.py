@@ -0,0 +1,284 @@
+# Search picks a move for the side to move in a GameState. It is a negamax alpha-beta search with iterative deepening,
+# so it always has the best move of the last finished depth ready when its time or node budget runs out.
+# Leaves are scored by Evaluation.evaluate, which reads scores GameState keeps up to date move by move.
+# Moves are ordered by MVV-LVA for captures, then killer moves, then the history heuristic, and leaf nodes are extended
+# with a quiescence search over captures so the score isn't taken in the middle of an exchange. Searched positions are
+# kept in a TranspositionTable; pass the same table to every Search of a game so it carries over between moves.
+# An OpeningBook and an EndgameTable (see Book) are probed at the root first, and a hit there skips the search.
+#
+#   search = Search(gs, tt, book=OpeningBook('book.bin'))
+#   move = search.search(timeLimit=2.0) # gs is searched in place and left as it was
+
+import time
+
+from .Evaluation import evaluate
+from .TranspositionTable import TranspositionTable, EXACT, LOWER, UPPER
+
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+MATE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+
+CAPTURE_SCORE = 1000000 #captures are searched before killers, killers before other quiet moves
+KILLER_SCORE = 900000
+PV_SCORE = 2000000
+
+
+'''
+Prints one line per finished depth, the default report for Search.search
+'''
+def printInfo(info):
+    print(f"depth {info['depth']} score {info['score']} nodes {info['nodes']} nps {info['nps']} "
+          f"time {info['time']:.2f} pv {' '.join(move.getChessNotation() for move in info['pv'])}")
+
+
+class Search():
+    def __init__(self, gs, tt=None, book=None, endgameTable=None):
+        self.gs = gs
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.book = book
+        self.endgameTable = endgameTable
+        self.nodes = 0
+        self.stopped = False
+        # moves are handled as packed moves (see ChessEngine) until the best one is handed back
+        self.killers = [[0, 0] for i in range(MAX_PLY)] #two quiet moves per ply that caused a beta cutoff
+        self.history = [0] * 4096 #start and end square -> how often that quiet move caused a cutoff, weighted by depth
+        self.pv = [[] for i in range(MAX_PLY + 1)] #pv[ply] is the best line found from ply onwards
+        self.previousPv = []
+        self.bestMove = None #Move view of the best packed move
+        self.score = 0
+        self.depth = 0
+
+    '''
+    Can be called from another thread to end the search, search() then returns the best move found so far
+    '''
+    def stop(self):
+        self.stopped = True
+
+    '''
+    Iterative deepening: searches depth 1, 2, ... until maxDepth, timeLimit (seconds) or nodeLimit is reached and returns
+    the best move of the last completed depth. report is called with a dictionary of depth, score, nodes, nps, time and pv
+    after every completed depth
+    '''
+    def search(self, maxDepth=MAX_PLY - 1, timeLimit=None, nodeLimit=None, report=printInfo):
+        self.nodes = 0
+        self.stopped = False
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.bestMove = None
+        self.previousPv = []
+        self.tt.newSearch()
+        rootMoves = self.gs.getValidMoveCodes()
+        if not rootMoves:
+            return None
+        if self.probeRoot(report):
+            return self.bestMove
+
+        bestCode = 0
+        for depth in range(1, maxDepth + 1):
+            score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            if self.stopped and bestCode:
+                break #a partly searched depth can't be trusted, keep the last full one
+            self.previousPv = self.pv[0]
+            if self.previousPv:
+                bestCode = self.previousPv[0]
+            self.score = score
+            self.depth = depth
+            elapsed = time.perf_counter() - self.startTime
+            if report is not None:
+                report({'depth': depth, 'score': score, 'nodes': self.nodes, 'time': elapsed,
+                        'nps': int(self.nodes / elapsed) if elapsed > 0 else 0, 'pv': self.pvMoves(self.previousPv)})
+            if self.stopped or abs(score) >= MATE - MAX_PLY: #out of budget, or a forced mate has been found
+                break
+            if self.deadline is not None and time.perf_counter() > self.startTime + (self.deadline - self.startTime) / 2:
+                break #the next depth takes several times as long as this one, so it wouldn't finish anyway
+        self.bestMove = self.gs.moveFromCode(bestCode or rootMoves[0])
+        return self.bestMove
+
+    '''
+    Looks the root position up in the book, then the endgame table. On a hit sets bestMove and score, reports it as
+    depth 0 and returns True
+    '''
+    def probeRoot(self, report):
+        code = None
+        score = 0
+        if self.book is not None:
+            code = self.book.chooseMove(self.gs)
+        if code is None and self.endgameTable is not None:
+            entry = self.endgameTable.probe(self.gs)
+            if entry is not None:
+                code, distance = entry
+                if distance > 0:
+                    score = MATE - distance
+                elif distance < 0:
+                    score = -MATE - distance
+        if code is None:
+            return False
+        self.bestMove = self.gs.moveFromCode(code)
+        self.score = score
+        self.depth = 0
+        if report is not None:
+            report({'depth': 0, 'score': score, 'nodes': 0, 'time': time.perf_counter() - self.startTime, 'nps': 0,
+                    'pv': [self.bestMove]})
+        return True
+
+    '''
+    Move views of a line of packed moves, made on the board one by one so each view has its pieces
+    '''
+    def pvMoves(self, line):
+        moves = []
+        for code in line:
+            moves.append(self.gs.moveFromCode(code))
+            self.gs.makeMoveCode(code)
+        for code in line:
+            self.gs.undoMove()
+        return moves
+
+    '''
+    Sets self.stopped once the time or node budget is used up. The clock is only read every 1024 nodes
+    '''
+    def checkLimits(self):
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopped = True
+        elif self.deadline is not None and self.nodes & 1023 == 0 and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        return self.stopped
+
+    def negamax(self, depth, alpha, beta, ply):
+        self.pv[ply] = []
+        if self.checkLimits():
+            return 0
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(alpha, beta, ply)
+        self.nodes += 1
+        gs = self.gs
+        if ply > 0 and (gs.halfmoveClock >= 100 or gs.repetitions()):
+            return 0 #a repeated position is scored as the draw it would become if both sides kept repeating
+        key = gs.zobristKey
+        ttMove = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttDepth, bound, ttScore, ttMove = entry
+            if ply > 0 and ttDepth >= depth:
+                ttScore = scoreFromTable(ttScore, ply)
+                if bound == EXACT or (bound == LOWER and ttScore >= beta) or (bound == UPPER and ttScore <= alpha):
+                    return ttScore
+        moves = gs.getValidMoveCodes()
+        if not moves:
+            return -MATE + ply if gs.inCheck() else 0 #checkmate, prefer the quickest one, or stalemate
+        self.orderMoves(moves, ply, ttMove)
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = 0
+        board = gs.board
+        for move in moves:
+            end = (move >> 6) & 63
+            quiet = board[end >> 3][end & 7] == '--'
+            gs.makeMoveCode(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+            if score > alpha:
+                alpha = score
+                self.pv[ply] = [move] + self.pv[ply + 1]
+                if score >= beta:
+                    if quiet:
+                        self.storeKiller(move, ply)
+                        self.history[move & 0xFFF] += depth * depth
+                    break
+
+        if bestScore >= beta:
+            bound = LOWER
+        elif bestScore > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        self.tt.store(key, depth, bound, scoreToTable(bestScore, ply), bestMove)
+        return bestScore
+
+    '''
+    Only searches captures until the position is quiet. The side to move may also "stand pat" and take the static score
+    '''
+    def quiescence(self, alpha, beta, ply):
+        self.pv[ply] = []
+        self.nodes += 1
+        standPat = evaluate(self.gs)
+        if standPat >= beta or ply >= MAX_PLY - 1:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        board = self.gs.board
+        captures = [(mvvLva(board, move), move) for move in self.gs.getValidMoveCodes()
+                    if board[(move >> 9) & 7][(move >> 6) & 7] != '--']
+        captures.sort(reverse=True)
+        for order, move in captures:
+            self.gs.makeMoveCode(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            self.gs.undoMove()
+            if self.stopped or self.checkLimits():
+                return 0
+            if score > alpha:
+                alpha = score
+                self.pv[ply] = [move] + self.pv[ply + 1]
+                if score >= beta:
+                    break
+        return alpha
+
+    '''
+    Sorts moves best first. The previous iteration's principal variation and the table's best move come first
+    '''
+    def orderMoves(self, moves, ply, ttMove=0):
+        pvMove = self.previousPv[ply] if ply < len(self.previousPv) else 0
+        killer1, killer2 = self.killers[ply]
+        history = self.history
+        board = self.gs.board
+
+        def moveScore(move):
+            if move == pvMove or move == ttMove:
+                return PV_SCORE
+            if board[(move >> 9) & 7][(move >> 6) & 7] != '--':
+                return CAPTURE_SCORE + mvvLva(board, move)
+            if move == killer1 or move == killer2:
+                return KILLER_SCORE
+            return history[move & 0xFFF]
+
+        moves.sort(key=moveScore, reverse=True)
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+'''
+Mate scores count plies from the root. The table stores them counted from the position itself, so a mate found through
+a transposition at another ply still has the right distance
+'''
+def scoreToTable(score, ply):
+    if score >= MATE - MAX_PLY:
+        return score + ply
+    if score <= -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= MATE - MAX_PLY:
+        return score - ply
+    if score <= -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+'''
+Most valuable victim, least valuable attacker: prefers taking big pieces with small ones
+'''
+def mvvLva(board, move):
+    return (PIECE_VALUES[board[(move >> 9) & 7][(move >> 6) & 7][1]] * 10
+            - PIECE_VALUES[board[(move & 63) >> 3][move & 7][1]])
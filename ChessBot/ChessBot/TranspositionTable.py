@@ -0,0 +1,105 @@
+# Fixed-size transposition table keyed by GameState.zobristKey. It remembers the result of every searched position so
+# Search doesn't redo the same subtree when it reaches the position again, by another move order or in the next
+# iteration of iterative deepening.
+#
+# The table is two flat arrays of unsigned 64-bit integers (keys and packed entries), so memory is fixed when the table is
+# made and no Python objects are stored. Slots come in buckets of two:
+#   slot 0 is depth-preferred: only replaced by a deeper (or equal) search, or when it is left over from an older search
+#   slot 1 is always-replace: takes everything slot 0 turns down, so recent positions are kept too
+#
+# Packed entry layout (low bits first):
+#   move        16 bits  Move.moveID of the best move, 0 if none
+#   score       20 bits  stored with SCORE_OFFSET added so it is never negative
+#   depth        8 bits
+#   bound        2 bits  EXACT, LOWER or UPPER
+#   generation   8 bits  which search stored it
+
+from array import array
+
+EXACT = 1 #score is the true score of the position
+LOWER = 2 #search failed high, the true score is at least score
+UPPER = 3 #search failed low, the true score is at most score
+
+SCORE_OFFSET = 1 << 19
+ENTRY_BYTES = 16 #8 for the key and 8 for the packed entry
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB=16):
+        # number of buckets is a power of two so a bucket is found by masking the key
+        buckets = 1
+        while buckets * 2 * 2 * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            buckets *= 2
+        self.bucketMask = buckets - 1
+        self.keys = array('Q', bytes(8 * 2 * buckets))
+        self.entries = array('Q', bytes(8 * 2 * buckets))
+        self.generation = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0 #probes that found the bucket holding other positions
+        self.stores = 0
+        self.overwrites = 0 #stores that pushed out a different position
+
+    '''
+    Empties the table, e.g. when a new game starts
+    '''
+    def clear(self):
+        size = len(self.keys)
+        self.keys = array('Q', bytes(8 * size))
+        self.entries = array('Q', bytes(8 * size))
+        self.generation = 0
+        self.resetStats()
+
+    '''
+    Call once before every search. Entries stored in earlier searches can then be replaced in the depth-preferred slot
+    '''
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    '''
+    Returns (depth, bound, score, move) for the position with this key, or None if it isn't in the table
+    '''
+    def probe(self, key):
+        self.probes += 1
+        slot = (key & self.bucketMask) << 1
+        keys = self.keys
+        if keys[slot] != key:
+            slot += 1
+            if keys[slot] != key:
+                if self.entries[slot - 1] or self.entries[slot]:
+                    self.collisions += 1
+                return None
+        self.hits += 1
+        data = self.entries[slot]
+        return ((data >> 36) & 0xFF, (data >> 44) & 0x3, ((data >> 16) & 0xFFFFF) - SCORE_OFFSET, data & 0xFFFF)
+
+    def store(self, key, depth, bound, score, move):
+        self.stores += 1
+        slot = (key & self.bucketMask) << 1
+        keys = self.keys
+        entries = self.entries
+        data = entries[slot]
+        # take the depth-preferred slot if it is empty, holds this position, is from an older search or is shallower
+        if (not data or keys[slot] == key or (data >> 46) & 0xFF != self.generation or (data >> 36) & 0xFF <= depth):
+            if data and keys[slot] != key:
+                self.overwrites += 1
+        else:
+            slot += 1
+            if entries[slot] and keys[slot] != key:
+                self.overwrites += 1
+        keys[slot] = key
+        entries[slot] = (move & 0xFFFF | (score + SCORE_OFFSET) << 16 | min(depth, 0xFF) << 36 | bound << 44
+                         | self.generation << 46)
+
+    '''
+    Counters for tuning: hit rate is hits per probe, fill is the share of used slots in the first thousand
+    '''
+    def stats(self):
+        sample = min(1000, len(self.entries))
+        used = sum(1 for i in range(sample) if self.entries[i])
+        return {'probes': self.probes, 'hits': self.hits, 'hitRate': self.hits / self.probes if self.probes else 0.0,
+                'collisions': self.collisions, 'stores': self.stores, 'overwrites': self.overwrites,
+                'fill': used / sample, 'sizeMB': len(self.keys) * ENTRY_BYTES / (1024 * 1024)}
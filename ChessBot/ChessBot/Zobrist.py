@@ -0,0 +1,33 @@
+# Zobrist keys for hashing positions. Every (piece, square) pair, the side to move, each set of castling rights and each
+# en passant file gets a fixed random 64-bit number, and a position's key is the XOR of the numbers for everything in it.
+# Because XOR undoes itself, GameState.makeMove/undoMove can update the key by XORing in just the parts that changed.
+# The keys come from a fixed seed so they are the same in every process and every run.
+
+import random
+
+_rng = random.Random(0x5EED_C4E55)
+
+PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+# PIECE_KEYS[piece][row][col]
+PIECE_KEYS = {piece: [[_rng.getrandbits(64) for c in range(8)] for r in range(8)] for piece in PIECES}
+SIDE_KEY = _rng.getrandbits(64) #XORed in when black is to move
+CASTLING_KEYS = [_rng.getrandbits(64) for i in range(16)] #indexed by the castling rights as a 4-bit mask
+EN_PASSANT_KEYS = [_rng.getrandbits(64) for c in range(8)] #indexed by the file of the en passant square
+
+
+'''
+Full hash of a position, used to set up a key and to check the incrementally updated one
+'''
+def hashPosition(board, whiteToMove, castlingRights=0, enPassantSquare=None):
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != '--':
+                key ^= PIECE_KEYS[piece][r][c]
+    if not whiteToMove:
+        key ^= SIDE_KEY
+    key ^= CASTLING_KEYS[castlingRights] #no rights has a key too, so makeMove can swap one mask's key for another
+    if enPassantSquare is not None:
+        key ^= EN_PASSANT_KEYS[enPassantSquare & 7]
+    return key
@@ -0,0 +1,141 @@
+# Perft (performance test) for the move generator. Counts every leaf of the legal move tree to a fixed depth, which both
+# checks getValidMoves against published node counts and gives a nodes-per-second baseline for the engine.
+#
+# Run it from the project folder:
+#   python -m ChessBot.perft --depth 4
+#   python -m ChessBot.perft --depth 3 --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"
+#   python -m ChessBot.perft --suite
+#   python -m ChessBot.perft --depth 4 --profile perft.json   (time each move generator, see Instrumentation)
+
+import argparse
+import sys
+import time
+
+from .ChessEngine import GameState
+from .Bitboard import BitboardState
+from . import Instrumentation
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Standard positions with their known node counts (from the Chess Programming Wiki perft results page). Between them they
+# cover castling, en passant, promotion and discovered checks
+SUITE = [
+    ('start', START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+
+'''
+Number of leaf nodes of the legal move tree under the current position. At depth 1 the moves are counted, not made
+'''
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoveCodes()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMoveCode(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+'''
+Perft split by root move, as a list of (move notation, nodes)
+'''
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMoveCode(move.moveID)
+        results.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+
+def makeState(fen, generator, bitboard, debugHash=False):
+    gs = GameState.fromFen(fen)
+    if bitboard:
+        return BitboardState.fromGameState(gs)
+    gs.moveGenerator = generator
+    gs.debugHash = debugHash
+    return gs
+
+
+def formatRate(nodes, elapsed):
+    return f'{elapsed:.3f}s ({nodes / elapsed if elapsed > 0 else 0:,.0f} nodes/sec)'
+
+
+'''
+Runs every position of SUITE and reports each depth against its known count. Returns True if all of them matched
+'''
+def runSuite(maxDepth, generator, bitboard, debugHash=False):
+    passed = True
+    totalNodes = 0
+    start = time.perf_counter()
+    for name, fen, counts in SUITE:
+        for depth, expected in sorted(counts.items()):
+            if depth > maxDepth:
+                break
+            gs = makeState(fen, generator, bitboard, debugHash)
+            t = time.perf_counter()
+            nodes = perft(gs, depth)
+            elapsed = time.perf_counter() - t
+            totalNodes += nodes
+            ok = nodes == expected
+            passed = passed and ok
+            print(f'{"ok  " if ok else "FAIL"} {name} depth {depth}: {nodes} (expected {expected}) {formatRate(nodes, elapsed)}')
+    print(f'Total: {totalNodes} nodes in {formatRate(totalNodes, time.perf_counter() - start)}')
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ChessBot.perft', description='Perft node counts for the move generator')
+    parser.add_argument('--depth', type=int, default=3, help='search depth (the maximum depth with --suite)')
+    parser.add_argument('--fen', default=START_FEN, help='position to count, defaults to the starting position')
+    parser.add_argument('--suite', action='store_true', help='check the standard positions against their known counts')
+    parser.add_argument('--generator', choices=['legal', 'filter'], default='legal', help='GameState.moveGenerator to use')
+    parser.add_argument('--bitboard', action='store_true', help='count with BitboardState instead of GameState')
+    parser.add_argument('--debug-hash', action='store_true', help='check the zobrist key against a full recompute after every move')
+    parser.add_argument('--profile', default=None, help='time the move generators and write the profile to this JSON file '
+                                                         '(and flamegraph stacks next to it, with .folded added)')
+    args = parser.parse_args(argv)
+
+    profiler = Instrumentation.enable() if args.profile else None
+    try:
+        return run(args)
+    finally:
+        if profiler is not None:
+            Instrumentation.disable()
+            print()
+            print(profiler.summary())
+            profiler.dumpJson(args.profile)
+            profiler.dumpFolded(args.profile + '.folded')
+
+def run(args):
+    if args.suite:
+        return 0 if runSuite(args.depth, args.generator, args.bitboard, args.debug_hash) else 1
+
+    gs = makeState(args.fen, args.generator, args.bitboard, args.debug_hash)
+    start = time.perf_counter()
+    results = divide(gs, args.depth) if args.depth > 0 else []
+    elapsed = time.perf_counter() - start
+    for notation, nodes in results:
+        print(f'{notation}: {nodes}')
+    total = sum(nodes for _, nodes in results) if args.depth > 0 else 1
+    print()
+    print(f'Moves: {len(results)}')
+    print(f'Nodes: {total}')
+    print(f'Time: {formatRate(total, elapsed)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# Headless UCI engine, for tournament managers and GUIs that speak the Universal Chess Interface:
+#   python -m ChessBot.uci
+# Commands come in on stdin and answers go out on stdout. The search runs on its own thread, so "isready" and "stop" are
+# answered straight away while it thinks. Nothing here imports pygame.
+# With the environment variable CHESSBOT_PROFILE set to a file name, the search is profiled (see Instrumentation) and the
+# profile is written to that file as JSON, with flamegraph stacks next to it, when the engine quits.
+
+import os
+import sys
+import threading
+
+from . import Instrumentation
+from .Book import OpeningBook, EndgameTable
+from .ChessEngine import GameState
+from .Search import Search, MATE, MAX_PLY
+from .TranspositionTable import TranspositionTable
+
+ENGINE_NAME = 'ChessBot'
+DEFAULT_HASH_MB = 16
+
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock() #the search thread writes info lines while the main thread answers commands
+        self.gs = GameState()
+        self.tt = TranspositionTable(DEFAULT_HASH_MB)
+        self.search = None
+        self.searchThread = None
+        self.book = None
+        self.endgameTable = None
+        self.stopEvent = threading.Event() #set by stop, an infinite search waits for it before sending bestmove
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    '''
+    Handles one line of input. Returns False once the engine should quit
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        try:
+            if command == 'uci':
+                self.send(f'id name {ENGINE_NAME}')
+                self.send('id author ChessBot authors')
+                self.send(f'option name Hash type spin default {DEFAULT_HASH_MB} min 1 max 1024')
+                self.send('option name BookFile type string default <empty>')
+                self.send('option name EndgameTableFile type string default <empty>')
+                self.send('uciok')
+            elif command == 'isready':
+                self.send('readyok')
+            elif command == 'ucinewgame':
+                self.stopSearch()
+                self.tt.clear()
+                self.gs = GameState()
+            elif command == 'setoption':
+                self.setOption(args)
+            elif command == 'position':
+                self.stopSearch()
+                self.setPosition(args)
+            elif command == 'go':
+                self.stopSearch()
+                self.go(args)
+            elif command == 'stop':
+                self.stopSearch()
+            elif command == 'd':
+                self.send(self.gs.toFen())
+            elif command == 'quit':
+                self.stopSearch()
+                return False
+        except ValueError as e: #a malformed command is reported and ignored, the engine keeps running
+            self.send(f'info string {command}: {e}')
+        return True
+
+    def setOption(self, args):
+        if 'name' in args and 'value' in args:
+            name = ' '.join(args[args.index('name') + 1:args.index('value')]).lower()
+            value = ' '.join(args[args.index('value') + 1:])
+            if name == 'hash':
+                self.stopSearch()
+                self.tt = TranspositionTable(max(1, int(value)))
+            elif name in ('bookfile', 'endgametablefile'):
+                self.stopSearch()
+                table = None
+                if value and value != '<empty>':
+                    try:
+                        table = (OpeningBook if name == 'bookfile' else EndgameTable)(value)
+                    except (OSError, ValueError) as e:
+                        self.send(f'info string cannot open {value}: {e}')
+                old = self.book if name == 'bookfile' else self.endgameTable
+                if old is not None:
+                    old.close()
+                if name == 'bookfile':
+                    self.book = table
+                else:
+                    self.endgameTable = table
+
+    '''
+    position [startpos | fen <fen>] [moves <move> ...]
+    '''
+    def setPosition(self, args):
+        movesAt = args.index('moves') if 'moves' in args else len(args)
+        if args and args[0] == 'fen':
+            self.gs = GameState.fromFen(' '.join(args[1:movesAt]))
+        else:
+            self.gs = GameState()
+        for notation in args[movesAt + 1:]:
+            for code in self.gs.getValidMoveCodes():
+                if self.gs.moveFromCode(code).getChessNotation() == notation:
+                    self.gs.makeMoveCode(code)
+                    break
+            else:
+                self.send(f'info string illegal move {notation}')
+                break
+
+    '''
+    go [depth N] [nodes N] [movetime ms] [wtime ms btime ms winc ms binc ms movestogo N] [infinite]
+    '''
+    def go(self, args):
+        options = {}
+        for i, token in enumerate(args):
+            if token in ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo') and i + 1 < len(args):
+                options[token] = int(args[i + 1])
+        infinite = 'infinite' in args
+        maxDepth = options.get('depth', MAX_PLY - 1)
+        nodeLimit = options.get('nodes')
+        timeLimit = None
+        if 'movetime' in options:
+            timeLimit = options['movetime'] / 1000
+        elif 'wtime' in options or 'btime' in options:
+            remaining = options.get('wtime' if self.gs.whiteToMove else 'btime', 0)
+            increment = options.get('winc' if self.gs.whiteToMove else 'binc', 0)
+            budget = remaining / options.get('movestogo', 30) + increment / 2
+            timeLimit = max(0.01, min(budget, remaining * 0.8) / 1000) #never plan to use most of the clock on one move
+
+        # the position is searched in place: every command that changes it stops the search first
+        search = Search(self.gs, self.tt, self.book, self.endgameTable)
+        self.search = search
+        self.stopEvent.clear()
+
+        def run():
+            move = None
+            try:
+                move = search.search(maxDepth=maxDepth, timeLimit=timeLimit, nodeLimit=nodeLimit, report=self.sendInfo)
+            except Exception as e:
+                self.send(f'info string search failed: {e!r}')
+            finally: #the GUI waits for a bestmove, so one is always sent
+                if infinite:
+                    self.stopEvent.wait() #"go infinite" only answers once it is told to stop, even if the search ended
+                self.send(f'bestmove {move.getChessNotation() if move is not None else "0000"}')
+
+        self.searchThread = threading.Thread(target=run, daemon=True)
+        self.searchThread.start()
+
+    def sendInfo(self, info):
+        score = info['score']
+        if abs(score) >= MATE - MAX_PLY:
+            plies = MATE - abs(score)
+            scoreText = f'mate {(plies + 1) // 2 if score > 0 else -((plies + 1) // 2)}'
+        else:
+            scoreText = f'cp {score}'
+        pv = ' '.join(move.getChessNotation() for move in info['pv'])
+        self.send(f"info depth {info['depth']} score {scoreText} nodes {info['nodes']} nps {info['nps']} "
+                  f"time {int(info['time'] * 1000)} pv {pv}")
+
+    '''
+    Stops a running search and waits for it to send its bestmove
+    '''
+    def stopSearch(self):
+        self.stopEvent.set()
+        while self.searchThread is not None and self.searchThread.is_alive():
+            self.search.stop() #repeated in case the thread hadn't started searching yet when the first stop was set
+            self.searchThread.join(0.05)
+        self.searchThread = None
+
+
+def main():
+    profilePath = os.environ.get('CHESSBOT_PROFILE')
+    profiler = Instrumentation.enable() if profilePath else None
+    engine = UciEngine()
+    try:
+        for line in sys.stdin:
+            if not engine.handle(line):
+                break
+        engine.stopSearch()
+    finally:
+        if profiler is not None:
+            Instrumentation.disable()
+            profiler.dumpJson(profilePath)
+            profiler.dumpFolded(profilePath + '.folded')
+
+
+if __name__ == '__main__':
+    main()